@@ -4,33 +4,56 @@ from collections import defaultdict
 import os
 import smtplib
 import hashlib
+import json
 import atexit
+import functools
+import gzip
+import queue
+import threading
+import time
+from collections import Counter
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 from flask import (
-    Flask, render_template, redirect, url_for, request, jsonify, flash
+    Flask, Response, make_response, render_template, redirect, url_for, request, jsonify, flash,
+    stream_with_context,
 )
 from flask_login import (
     LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 )
 from werkzeug.security import generate_password_hash, check_password_hash
+try:
+    import brotli
+except ImportError:  # optional: gzip is used when brotli is not installed
+    brotli = None
+from sqlalchemy import Date, and_, or_, exists, false, func, literal, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from database import Base, engine, SessionLocal
+from database import Base, engine, SessionLocal, ensure_columns, ensure_indexes
 import models
-from ml import (
-    train_models_for_user,
-    train_global_models,
-    predict_items_for_today,
-    load_model_metrics,
-    load_global_model_metrics,
+import events
+from export import iter_history_rows, iter_csv, iter_parquet
+from feature_store import ensure_feature_store, refresh_features
+from online_counts import ensure_online_counts, global_counts_version
+from retrain_queue import (
+    RETRAIN_DEBOUNCE_SECONDS,
+    due_retrains,
+    labelled_row_count,
+    mark_labels_changed,
+    record_training,
+    request_refits,
 )
-
-# Ensure DB tables exist
-Base.metadata.create_all(bind=engine)
+from leases import instance_id, try_acquire_lease, release_lease
+# `ml` pulls in pandas and scikit-learn, so it is imported inside the
+# functions that use it: the app starts without loading them.
 
 app = Flask(
     __name__,
@@ -46,6 +69,56 @@ EMAIL_USER = os.environ.get("EMAIL_USER")          # e.g. your Gmail address
 EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD")  # Gmail app password
 APP_BASE_URL = os.environ.get("APP_BASE_URL", "http://localhost:5000")
 TEST_EMAIL_TO = os.environ.get("TEST_EMAIL_TO")
+
+# Daily reminder job: users are processed in batches, several in parallel.
+# Reminders go out per user at their local reminder time (default 8:00),
+# grouped into REMINDER_SLOT_MINUTES-wide time slots.
+DEFAULT_REMINDER_TIME = dt.time(int(os.environ.get("REMINDER_HOUR", "8")), 0)
+REMINDER_SLOT_MINUTES = int(os.environ.get("REMINDER_SLOT_MINUTES", "15"))
+# A slot missed (e.g. while the app was down) is still sent this long after
+# its reminder time; after that it waits for the next day
+REMINDER_CATCHUP_MINUTES = int(os.environ.get("REMINDER_CATCHUP_MINUTES", "60"))
+GLOBAL_RETRAIN_HOUR = int(os.environ.get("GLOBAL_RETRAIN_HOUR", "7"))
+REMINDER_BATCH_SIZE = int(os.environ.get("REMINDER_BATCH_SIZE", "50"))
+REMINDER_WORKERS = int(os.environ.get("REMINDER_WORKERS", "4"))
+REMINDER_MAX_ATTEMPTS = int(os.environ.get("REMINDER_MAX_ATTEMPTS", "3"))
+# ReminderLog is done once the email is in the outbox; delivery is tracked on EmailOutbox
+REMINDER_DONE_STATUSES = ("queued",)
+REMINDER_TEMPLATE = "email/daily_reminder.html"
+
+# JSON responses at least this big are gzip/brotli-compressed
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+
+# /api/history page size (days per page)
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "30"))
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Email delivery: rendered messages go to the outbox, drained by these workers
+EMAIL_WORKERS = int(os.environ.get("EMAIL_WORKERS", "4"))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_STALE_MINUTES = int(os.environ.get("OUTBOX_STALE_MINUTES", "10"))
+
+# Leader election: only the process holding this lease runs background jobs
+SCHEDULER_LEASE_NAME = "scheduler"
+SCHEDULER_LEASE_SECONDS = int(os.environ.get("SCHEDULER_LEASE_SECONDS", "90"))
+
+# Preload the global model and the most active users' models at startup;
+# /readyz reports not-ready until they are loaded.
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "0") == "1"
+
+# Days of daily_predictions snapshots kept (older ones are pruned each morning)
+PREDICTION_SNAPSHOT_DAYS = int(os.environ.get("PREDICTION_SNAPSHOT_DAYS", "7"))
+
+# /api/events: re-check for changes made by other processes this often,
+# and end each stream after EVENTS_MAX_SECONDS (the browser reconnects)
+EVENTS_POLL_SECONDS = int(os.environ.get("EVENTS_POLL_SECONDS", "15"))
+EVENTS_MAX_SECONDS = int(os.environ.get("EVENTS_MAX_SECONDS", "300"))
+# Each stream holds a server thread: at most this many per process
+# (see the thread budget in gunicorn.conf.py). Streams beyond the cap are
+# told to reconnect after EVENTS_BUSY_RETRY_MS.
+EVENTS_MAX_STREAMS = int(os.environ.get("EVENTS_MAX_STREAMS", "8"))
+EVENTS_BUSY_RETRY_MS = int(os.environ.get("EVENTS_BUSY_RETRY_MS", "30000"))
+
 # ---- Flask-Login Setup ----
 login_manager = LoginManager()
 login_manager.login_view = "login"
@@ -57,6 +130,7 @@ class UserLogin(UserMixin):
     def __init__(self, user: models.User):
         self.id = user.id
         self.email = user.email
+        self.timezone = user.timezone
 
 
 @login_manager.user_loader
@@ -75,6 +149,53 @@ def get_session() -> Session:
     return SessionLocal()
 
 
+def bump_checklist_version(db: Session, context_id: int, expected=None):
+    """
+    Increment a day's checklist_version; with `expected`, only if it is
+    still that version. Returns the new version, or None if it was stale.
+    Part of the caller's transaction; the caller commits.
+    """
+    contexts = models.DayContext.__table__
+    current = func.coalesce(contexts.c.checklist_version, 0)
+    criteria = [contexts.c.id == context_id]
+    if expected is not None:
+        criteria.append(current == expected)
+    return db.execute(
+        contexts.update()
+        .where(*criteria)
+        .values(checklist_version=current + 1)
+        .returning(contexts.c.checklist_version)
+    ).scalar()
+
+
+def bump_data_version(db: Session, *user_criteria):
+    """
+    Mark the data of the matching users as changed (invalidates their ETags).
+    Part of the caller's transaction; the caller commits.
+    """
+    (
+        db.query(models.User)
+        .filter(*user_criteria)
+        .update({models.User.data_version: func.coalesce(models.User.data_version, 0) + 1},
+                synchronize_session=False)
+    )
+
+
+def local_now(tz_name: str = None) -> dt.datetime:
+    """Current time in the given IANA timezone (server local time if unset/unknown)."""
+    if tz_name:
+        try:
+            return dt.datetime.now(ZoneInfo(tz_name))
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    return dt.datetime.now()
+
+
+def user_today() -> dt.date:
+    """Today's date for the logged-in user, in their own timezone."""
+    return local_now(current_user.timezone).date()
+
+
 # --------- DEFAULT ITEMS FOR ALL USERS --------- #
 
 DEFAULT_ITEMS = [
@@ -120,6 +241,7 @@ def ensure_default_items(db: Session, user_id: int):
             created_any = True
 
     if created_any:
+        bump_data_version(db, models.User.id == user_id)
         db.commit()
 
 # ----------------- EMAIL HELPERS ----------------- #
@@ -157,6 +279,27 @@ def verify_email_token(user_id: int, date_str: str, token: str) -> bool:
 
 # ----------------- AUTH ROUTES ----------------- #
 
+@app.route("/readyz")
+def readyz():
+    """
+    Readiness probe. With MODEL_WARMUP on, a process whose model cache is
+    still cold answers 503 (and starts warming it), so it only gets
+    traffic once its first prediction runs at warm latency.
+    """
+    from ml import model_cache_status
+    db = SessionLocal()
+    try:
+        db.execute(select(literal(1)))
+    finally:
+        db.close()
+
+    status = model_cache_status()
+    if MODEL_WARMUP and status["models"] == "cold":
+        start_model_warmup()
+        return jsonify(dict(status, ready=False)), 503
+    return jsonify(dict(status, ready=True))
+
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
@@ -238,6 +381,7 @@ def items():
                     category=category,
                 )
                 db.add(item)
+                bump_data_version(db, models.User.id == current_user.id)
                 db.commit()
                 flash("Item added.", "success")
         items_list = (
@@ -255,7 +399,7 @@ def items():
 def history():
     db = get_session()
     try:
-        today = dt.date.today()
+        today = user_today()
         ctx = (
             db.query(models.DayContext)
             .filter(models.DayContext.user_id == current_user.id,
@@ -290,43 +434,350 @@ def simulate():
 
 # ----------------- CONTEXT HELPER ----------------- #
 
-def get_or_create_today_context(db: Session, user_id: int) -> models.DayContext:
-    today = dt.date.today()
-    ctx = (
-        db.query(models.DayContext)
-        .filter(models.DayContext.user_id == user_id,
-                models.DayContext.date == today)
-        .first()
-    )
+def get_or_create_today_context(db: Session, user_id: int, today: dt.date = None) -> models.DayContext:
+    today = today or dt.date.today()
+    query = db.query(models.DayContext).filter(models.DayContext.user_id == user_id,
+                                               models.DayContext.date == today)
+    ctx = query.first()
     if ctx:
         return ctx
 
-    ctx = models.DayContext(
-        user_id=user_id,
-        date=today,
-        weekday=today.weekday(),
-        is_holiday=False,
-        has_work_event=False,
-        has_gym_event=False,
+    # the hourly pre-pass (ensure_day_contexts) or another request may
+    # insert the same day in the meantime: keep whichever row came first
+    result = db.execute(
+        insert(models.DayContext)
+        .values(user_id=user_id, date=today, weekday=today.weekday(),
+                is_holiday=False, has_work_event=False, has_gym_event=False)
+        .on_conflict_do_nothing(index_elements=["user_id", "date"])
     )
-    db.add(ctx)
+    if result.rowcount:
+        bump_data_version(db, models.User.id == user_id)
     db.commit()
-    db.refresh(ctx)
-    return ctx
+    return query.one()
+
+
+def ensure_day_contexts(db: Session, date: dt.date, *user_criteria) -> int:
+    """
+    Create `date`'s DayContext for every user (optionally filtered by
+    `user_criteria` on models.User) that does not have one yet.
+    One INSERT ... SELECT with an anti-join, whatever the number of users.
+    Returns the number of contexts created.
+    """
+    missing = ~exists().where(
+        models.DayContext.user_id == models.User.id,
+        models.DayContext.date == date,
+    )
+    rows = select(
+        models.User.id,
+        literal(date, Date),
+        literal(date.weekday()),
+        false(),
+        false(),
+        false(),
+    ).where(missing, *user_criteria)
+
+    bump_data_version(db, missing, *user_criteria)
+    result = db.execute(
+        insert(models.DayContext).from_select(
+            ["user_id", "date", "weekday", "is_holiday", "has_work_event", "has_gym_event"],
+            rows,
+        ).on_conflict_do_nothing(index_elements=["user_id", "date"])  # a request got there first
+    )
+    db.commit()
+    return result.rowcount
+
+# ----------------- CONDITIONAL GET / COMPRESSION ----------------- #
+
+def compute_etag(endpoint: str, query_string: str, user_id: int, data_version, today: dt.date,
+                 uses_model: bool = False, counts_version: Optional[str] = None) -> str:
+    """
+    ETag for a per-user JSON payload (shared by the WSGI and ASGI apps).
+    `counts_version` is pooled_counts_version() for prediction endpoints.
+    """
+    raw = f"{endpoint}:{query_string}:{user_id}:{data_version}:{today}"
+    if uses_model:
+        from ml import model_version
+        raw += f":{model_version(user_id)}"
+        if counts_version is not None:
+            raw += f":{counts_version}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def pooled_counts_version(db: Session) -> Optional[str]:
+    """
+    Version of the pooled (all-users) counts when predictions come from
+    them, else None: other users' writes change count-based predictions
+    without touching this user's data_version.
+    """
+    from ml import PREDICTOR
+    if PREDICTOR != "counts":
+        return None
+    return global_counts_version(db)
+
+
+def conditional_json(uses_model: bool = False):
+    """
+    ETag / If-None-Match support for per-user JSON endpoints.
+    The ETag is derived from the user's data_version, their local date and
+    (for prediction-based endpoints) the model version, so an unchanged
+    payload is answered with 304 before any of the real work is done.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            db = get_session()
+            try:
+                data_version = (
+                    db.query(models.User.data_version)
+                    .filter(models.User.id == current_user.id)
+                    .scalar()
+                )
+                counts_version = pooled_counts_version(db) if uses_model else None
+            finally:
+                db.close()
+
+            etag = compute_etag(request.endpoint, request.query_string.decode(),
+                                current_user.id, data_version, user_today(), uses_model, counts_version)
+
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=304)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag, weak=True)
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+        return wrapper
+    return decorator
+
+
+@app.after_request
+def compress_response(resp):
+    """Compress larger JSON responses with brotli (if available) or gzip."""
+    if (
+        resp.status_code != 200
+        or resp.direct_passthrough
+        or resp.is_streamed
+        or resp.mimetype != "application/json"
+        or "Content-Encoding" in resp.headers
+    ):
+        return resp
+
+    resp.vary.add("Accept-Encoding")
+    body = resp.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return resp
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        resp.set_data(brotli.compress(body, quality=5))
+        resp.headers["Content-Encoding"] = "br"
+    elif accepted["gzip"]:
+        resp.set_data(gzip.compress(body, compresslevel=6))
+        resp.headers["Content-Encoding"] = "gzip"
+    return resp
+
+# ----------------- DASHBOARD DATA BUILDERS ----------------- #
+
+def active_items(db: Session, user_id: int) -> list:
+    return (
+        db.query(models.Item)
+        .filter(models.Item.user_id == user_id,
+                models.Item.active == True)
+        .all()
+    )
+
+
+def context_features(ctx: models.DayContext) -> dict:
+    return {
+        "weekday": ctx.weekday,
+        "is_holiday": int(ctx.is_holiday),
+        "has_work_event": int(ctx.has_work_event),
+        "has_gym_event": int(ctx.has_gym_event),
+    }
+
+
+def build_checklist(db: Session, user_id: int, ctx: models.DayContext, items: list) -> dict:
+    statuses = (
+        db.query(models.DailyItemStatus)
+        .filter(models.DailyItemStatus.user_id == user_id,
+                models.DailyItemStatus.context_id == ctx.id)
+        .all()
+    )
+    status_map = {s.item_id: s for s in statuses}
+
+    checklist = []
+    for it in items:
+        st = status_map.get(it.id)
+        checklist.append(
+            {
+                "item_id": it.id,
+                "name": it.name,
+                "priority": it.priority,
+                "packed": bool(st.packed) if st else False,
+                "needed_label": st.needed_label if st else None,
+            }
+        )
+    return {
+        "date": str(ctx.date),
+        "weekday": ctx.weekday,
+        "version": ctx.checklist_version or 0,
+        "items": checklist,
+    }
+
+
+def prediction_item_dicts(items: list) -> list:
+    return [
+        {"id": it.id, "name": it.name, "priority": it.priority, "category": it.category}
+        for it in items
+    ]
+
+
+def uses_prediction_snapshots() -> bool:
+    """
+    Count-based predictions are not snapshotted: they cost two indexed
+    queries, and any user's write changes them, so nearly every read
+    would replace the snapshot (a write) instead of reading it.
+    """
+    from ml import PREDICTOR
+    return PREDICTOR != "counts"
+
+
+def prediction_snapshot_key(db: Session, user_id: int, ctx: models.DayContext, item_dicts: list):
+    """
+    (model_version, context_key) a stored prediction snapshot must match:
+    the serving model set, and a hash of the day context and item list.
+    """
+    from ml import model_version
+    version = model_version(user_id)
+    raw = json.dumps([context_features(ctx), item_dicts], sort_keys=True)
+    return version, hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def load_prediction_snapshot(db: Session, user_id: int, date: dt.date, version: str, key: str):
+    """The stored predictions for this day, model version and context, or None."""
+    snapshot = db.execute(
+        select(models.DailyPrediction.predictions).where(
+            models.DailyPrediction.user_id == user_id,
+            models.DailyPrediction.date == date,
+            models.DailyPrediction.model_version == version,
+            models.DailyPrediction.context_key == key,
+        )
+    ).scalar()
+    return json.loads(snapshot) if snapshot is not None else None
+
+
+def store_prediction_snapshot(db: Session, user_id: int, date: dt.date, version: str, key: str,
+                              predictions: list):
+    """Replace the user's snapshot for `date`. Does not commit."""
+    db.query(models.DailyPrediction).filter(
+        models.DailyPrediction.user_id == user_id,
+        models.DailyPrediction.date == date,
+    ).delete(synchronize_session=False)
+    db.add(models.DailyPrediction(
+        user_id=user_id, date=date, model_version=version, context_key=key,
+        predictions=json.dumps(predictions), created_at=dt.datetime.utcnow(),
+    ))
+
+
+def build_predictions(db: Session, user_id: int, ctx: models.DayContext, items: list) -> list:
+    """
+    Today's ranked predictions, read from the daily_predictions snapshot.
+    They are only recomputed (and the snapshot replaced) when the model
+    version, the day context or the item list changed. Count-based
+    predictions are always computed (see uses_prediction_snapshots).
+    """
+    from ml import predict_items_for_today
+    item_dicts = prediction_item_dicts(items)
+    if not uses_prediction_snapshots():
+        return predict_items_for_today(user_id, context_features(ctx), item_dicts)
+
+    version, key = prediction_snapshot_key(db, user_id, ctx, item_dicts)
+    predictions = load_prediction_snapshot(db, user_id, ctx.date, version, key)
+    if predictions is not None:
+        return predictions
+
+    predictions = predict_items_for_today(user_id, context_features(ctx), item_dicts)
+    try:
+        store_prediction_snapshot(db, user_id, ctx.date, version, key, predictions)
+        db.commit()
+    except IntegrityError:
+        db.rollback()  # a concurrent request stored the same snapshot
+    return predictions
+
+
+def build_today_context(ctx):
+    if not ctx:
+        return None
+    day_type = "Weekend" if ctx.weekday >= 5 else "Weekday"
+    return {
+        "date": str(ctx.date),
+        "weekday": ctx.weekday,
+        "day_type": day_type,
+        "has_work_event": bool(ctx.has_work_event),
+        "has_gym_event": bool(ctx.has_gym_event),
+    }
+
+
+def build_insights(db: Session, user_id: int, ctx) -> dict:
+    from ml import load_model_metrics
+    q = (
+        db.query(models.DailyItemStatus, models.Item)
+        .join(models.Item, models.Item.id == models.DailyItemStatus.item_id)
+        .filter(models.DailyItemStatus.user_id == user_id)
+    )
+
+    stats = defaultdict(lambda: {
+        "item_id": None,
+        "name": "",
+        "needed_days": 0,
+        "packed_when_needed": 0,
+        "forgotten_days": 0,
+        "total_days": 0,
+    })
+
+    for st, item in q:
+        entry = stats[item.id]
+        entry["item_id"] = item.id
+        entry["name"] = item.name
+
+        if st.needed_label is not None:
+            entry["total_days"] += 1
+            if st.needed_label:
+                entry["needed_days"] += 1
+                if st.packed:
+                    entry["packed_when_needed"] += 1
+                else:
+                    entry["forgotten_days"] += 1
+
+    per_item_stats = []
+    for item_id, entry in stats.items():
+        if entry["needed_days"] > 0:
+            forget_rate = entry["forgotten_days"] / entry["needed_days"]
+        else:
+            forget_rate = 0.0
+        entry["forget_rate"] = forget_rate
+        per_item_stats.append(entry)
+
+    top_forgotten = sorted(per_item_stats, key=lambda x: x["forget_rate"], reverse=True)
+
+    return {
+        "per_item_stats": per_item_stats,
+        "top_forgotten": top_forgotten,
+        "model_metrics": load_model_metrics(user_id),
+        "today_context": build_today_context(ctx),
+    }
 
 # ----------------- API: ITEMS / CHECKLIST / ML ----------------- #
 
 @app.route("/api/items")
 @login_required
+@conditional_json()
 def api_items():
     db = get_session()
     try:
-        items = (
-            db.query(models.Item)
-            .filter(models.Item.user_id == current_user.id,
-                    models.Item.active == True)
-            .all()
-        )
+        items = active_items(db, current_user.id)
         out = [
             {
                 "id": it.id,
@@ -344,41 +795,13 @@ def api_items():
 
 @app.route("/api/checklist_today")
 @login_required
+@conditional_json()
 def api_checklist_today():
     db = get_session()
     try:
-        ctx = get_or_create_today_context(db, current_user.id)
-        items = (
-            db.query(models.Item)
-            .filter(models.Item.user_id == current_user.id,
-                    models.Item.active == True)
-            .all()
-        )
-        statuses = (
-            db.query(models.DailyItemStatus)
-            .filter(models.DailyItemStatus.user_id == current_user.id,
-                    models.DailyItemStatus.context_id == ctx.id)
-            .all()
-        )
-        status_map = {s.item_id: s for s in statuses}
-
-        checklist = []
-        for it in items:
-            st = status_map.get(it.id)
-            checklist.append(
-                {
-                    "item_id": it.id,
-                    "name": it.name,
-                    "priority": it.priority,
-                    "packed": bool(st.packed) if st else False,
-                    "needed_label": st.needed_label if st else None,
-                }
-            )
-        return jsonify({
-            "date": str(ctx.date),
-            "weekday": ctx.weekday,
-            "items": checklist,
-        })
+        ctx = get_or_create_today_context(db, current_user.id, user_today())
+        items = active_items(db, current_user.id)
+        return jsonify(build_checklist(db, current_user.id, ctx, items))
     finally:
         db.close()
 
@@ -386,40 +809,98 @@ def api_checklist_today():
 @app.route("/api/checklist_update", methods=["POST"])
 @login_required
 def api_checklist_update():
-    data = request.get_json()
-    statuses = data.get("statuses", [])
+    """
+    Apply checklist changes for today.
+
+    Delta clients send {"version": v, "changes": [{"item_id", "packed"?,
+    "needed_label"?}, ...]} with only the toggled items; a version other
+    than the day's current checklist_version is rejected with 409 and the
+    current checklist, so the client can re-apply its changes on top.
+    The full {"statuses": [...]} payload of older clients is still
+    accepted. Either way only rows whose values actually change are
+    written, and their features refreshed. Every item_id must be one of
+    the user's active items.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Expected a JSON object"}), 400
+    version = data.get("version")
+    changes = data.get("changes")
+    if changes is None:
+        statuses = data.get("statuses", [])
+        if not isinstance(statuses, list) or not all(isinstance(st, dict) for st in statuses):
+            return jsonify({"status": "error", "message": "statuses must be a list of objects"}), 400
+        changes = [dict(st, packed=bool(st.get("packed", False))) for st in statuses]
+    if not isinstance(changes, list) or not all(
+        isinstance(ch, dict) and type(ch.get("item_id")) is int for ch in changes
+    ):
+        return jsonify({"status": "error", "message": "changes must be a list of objects with an item_id"}), 400
 
     db = get_session()
     try:
-        ctx = get_or_create_today_context(db, current_user.id)
-        for st_json in statuses:
-            item_id = st_json.get("item_id")
-            packed = bool(st_json.get("packed", False))
-            needed_label = st_json.get("needed_label")
+        item_ids = {ch["item_id"] for ch in changes}
+        unknown = item_ids - {item.id for item in active_items(db, current_user.id)}
+        if unknown:
+            return jsonify({"status": "error", "message": f"Unknown item ids: {sorted(unknown)}"}), 400
 
-            st = (
-                db.query(models.DailyItemStatus)
-                .filter(
-                    models.DailyItemStatus.user_id == current_user.id,
-                    models.DailyItemStatus.context_id == ctx.id,
-                    models.DailyItemStatus.item_id == item_id,
-                )
-                .first()
+        ctx = get_or_create_today_context(db, current_user.id, user_today())
+        current = ctx.checklist_version or 0
+
+        def stale():
+            db.rollback()
+            db.refresh(ctx)
+            checklist = build_checklist(db, current_user.id, ctx, active_items(db, current_user.id))
+            return jsonify({"status": "stale", "version": checklist["version"], "checklist": checklist}), 409
+
+        if version is not None and version != current:
+            return stale()
+
+        existing = {
+            st.item_id: st
+            for st in db.query(models.DailyItemStatus).filter(
+                models.DailyItemStatus.user_id == current_user.id,
+                models.DailyItemStatus.context_id == ctx.id,
+                models.DailyItemStatus.item_id.in_(item_ids),
             )
-            if not st:
+        }
+
+        changed = set()
+        for ch in changes:
+            item_id = ch["item_id"]
+            st = existing.get(item_id)
+            old_packed, old_needed = (bool(st.packed), st.needed_label) if st else (False, None)
+            packed = bool(ch["packed"]) if ch.get("packed") is not None else old_packed
+            needed_label = bool(ch["needed_label"]) if ch.get("needed_label") is not None else old_needed
+            if (packed, needed_label) == (old_packed, old_needed):
+                continue
+
+            if st is None:
                 st = models.DailyItemStatus(
                     user_id=current_user.id,
                     context_id=ctx.id,
                     item_id=item_id,
                 )
                 db.add(st)
-
+                existing[item_id] = st
             st.packed = packed
-            if needed_label is not None:
-                st.needed_label = bool(needed_label)
-
+            st.needed_label = needed_label
+            changed.add(item_id)
+
+        if not changed:
+            return jsonify({"status": "ok", "version": current, "applied": 0})
+
+        # conditional bump: a concurrent write since `current` makes this request stale
+        new_version = bump_checklist_version(db, ctx.id, expected=current)
+        if new_version is None:
+            return stale()
+
+        refresh_features(db, models.DailyItemStatus.user_id == current_user.id,
+                         models.DailyItemStatus.context_id == ctx.id,
+                         models.DailyItemStatus.item_id.in_(changed))
+        mark_labels_changed(db, current_user.id)
+        bump_data_version(db, models.User.id == current_user.id)
         db.commit()
-        return jsonify({"status": "ok"})
+        return jsonify({"status": "ok", "version": new_version, "applied": len(changed)})
     finally:
         db.close()
 
@@ -429,7 +910,7 @@ def api_checklist_update():
 def api_train_model():
     db = get_session()
     try:
-        ok = train_models_for_user(db, current_user.id)
+        ok = train_and_record(db, current_user.id)
         if not ok:
             return jsonify({"status": "error", "message": "Not enough data to train model"}), 400
         return jsonify({"status": "trained"})
@@ -437,33 +918,105 @@ def api_train_model():
         db.close()
 
 
+def _event_state(db: Session, user_id: int, today: dt.date):
+    """
+    What a stream last told the client: (model version, today's prediction
+    snapshot), or for count-based predictions the versions of the counts
+    they are computed from.
+    """
+    from ml import model_version
+    if not uses_prediction_snapshots():
+        data_version = db.query(models.User.data_version).filter(models.User.id == user_id).scalar()
+        return model_version(user_id), (data_version, global_counts_version(db))
+    snapshot = db.execute(
+        select(models.DailyPrediction.context_key, models.DailyPrediction.created_at).where(
+            models.DailyPrediction.user_id == user_id,
+            models.DailyPrediction.date == today,
+        )
+    ).first()
+    return model_version(user_id), tuple(snapshot) if snapshot else None
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/api/events")
+@login_required
+def api_events():
+    """
+    Server-sent events for the logged-in user:
+
+      model-updated  {"model_version"}         a retrain produced a new model
+      predictions    {"date", "predictions"}   today's predictions changed
+
+    The stream wakes when this process notifies it (see events.py) and
+    otherwise re-checks every EVENTS_POLL_SECONDS, so changes made by
+    another process are pushed too. Nothing is sent while nothing
+    changed, apart from keep-alive comments.
+
+    With EVENTS_MAX_STREAMS streams already open in this process, the
+    response only asks the browser to retry later. That is a 200, not a
+    503: EventSource gives up for good on an error status.
+    """
+    if not events.open_stream(EVENTS_MAX_STREAMS):
+        resp = Response(f"retry: {EVENTS_BUSY_RETRY_MS}\n\n", mimetype="text/event-stream")
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+
+    user_id = current_user.id
+
+    def stream():
+        wakeups = events.subscribe(user_id)
+        db = SessionLocal.session_factory()
+        try:
+            state = _event_state(db, user_id, user_today())
+            db.rollback()  # end the read transaction between checks
+            yield "retry: 5000\n\n"
+
+            deadline = time.monotonic() + EVENTS_MAX_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    wakeups.get(timeout=EVENTS_POLL_SECONDS)
+                except queue.Empty:
+                    pass
+
+                today = user_today()
+                current = _event_state(db, user_id, today)
+                if current == state:
+                    db.rollback()
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if current[0] != state[0]:
+                    yield _sse("model-updated", {"model_version": current[0]})
+                ctx = get_or_create_today_context(db, user_id, today)
+                predictions = build_predictions(db, user_id, ctx, active_items(db, user_id))
+                yield _sse("predictions", {"date": str(today), "predictions": predictions})
+                state = _event_state(db, user_id, today)
+                db.rollback()
+        finally:
+            events.unsubscribe(user_id, wakeups)
+            db.close()
+
+    resp = Response(stream_with_context(stream()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # don't let a proxy buffer the stream
+    # runs when the server closes the response, even if the stream never started
+    resp.call_on_close(events.close_stream)
+    return resp
+
+
 @app.route("/api/predict_today")
 @login_required
+@conditional_json(uses_model=True)
 def api_predict_today():
     db = get_session()
     try:
-        today = dt.date.today()
-        ctx = get_or_create_today_context(db, current_user.id)
-
-        context_features = {
-            "weekday": ctx.weekday,
-            "is_holiday": int(ctx.is_holiday),
-            "has_work_event": int(ctx.has_work_event),
-            "has_gym_event": int(ctx.has_gym_event),
-        }
-
-        items = (
-            db.query(models.Item)
-            .filter(models.Item.user_id == current_user.id,
-                    models.Item.active == True)
-            .all()
-        )
-        item_dicts = [
-            {"id": it.id, "name": it.name, "priority": it.priority}
-            for it in items
-        ]
-
-        preds = predict_items_for_today(current_user.id, context_features, item_dicts)
+        today = user_today()
+        ctx = get_or_create_today_context(db, current_user.id, today)
+        items = active_items(db, current_user.id)
+        preds = build_predictions(db, current_user.id, ctx, items)
         return jsonify({"date": str(today), "predictions": preds})
     finally:
         db.close()
@@ -483,25 +1036,20 @@ def api_simulate_predict():
 
     db = get_session()
     try:
-        items = (
-            db.query(models.Item)
-            .filter(models.Item.user_id == current_user.id,
-                    models.Item.active == True)
-            .all()
-        )
         item_dicts = [
-            {"id": it.id, "name": it.name, "priority": it.priority}
-            for it in items
+            {"id": it.id, "name": it.name, "priority": it.priority, "category": it.category}
+            for it in active_items(db, current_user.id)
         ]
 
-        context_features = {
+        simulated_context = {
             "weekday": weekday,
             "is_holiday": is_holiday,
             "has_work_event": has_work_event,
             "has_gym_event": has_gym_event,
         }
 
-        preds = predict_items_for_today(current_user.id, context_features, item_dicts)
+        from ml import predict_items_for_today
+        preds = predict_items_for_today(current_user.id, simulated_context, item_dicts)
         return jsonify({"predictions": preds})
     finally:
         db.close()
@@ -510,89 +1058,258 @@ def api_simulate_predict():
 
 @app.route("/api/insights")
 @login_required
+@conditional_json(uses_model=True)
 def api_insights():
     db = get_session()
     try:
-        q = (
-            db.query(models.DailyItemStatus, models.Item, models.DayContext)
-            .join(models.Item, models.Item.id == models.DailyItemStatus.item_id)
-            .join(models.DayContext, models.DayContext.id == models.DailyItemStatus.context_id)
-            .filter(models.DailyItemStatus.user_id == current_user.id)
+        ctx = (
+            db.query(models.DayContext)
+            .filter(models.DayContext.user_id == current_user.id,
+                    models.DayContext.date == user_today())
+            .first()
         )
+        return jsonify(build_insights(db, current_user.id, ctx))
+    finally:
+        db.close()
 
-        stats = defaultdict(lambda: {
-            "item_id": None,
-            "name": "",
-            "needed_days": 0,
-            "packed_when_needed": 0,
-            "forgotten_days": 0,
-            "total_days": 0,
-        })
+# ----------------- DASHBOARD (COMBINED) ----------------- #
 
-        for st, item, ctx in q:
-            entry = stats[item.id]
-            entry["item_id"] = item.id
-            entry["name"] = item.name
-
-            if st.needed_label is not None:
-                entry["total_days"] += 1
-                if st.needed_label:
-                    entry["needed_days"] += 1
-                    if st.packed:
-                        entry["packed_when_needed"] += 1
-                    else:
-                        entry["forgotten_days"] += 1
-
-        per_item_stats = []
-        for item_id, entry in stats.items():
-            if entry["needed_days"] > 0:
-                forget_rate = entry["forgotten_days"] / entry["needed_days"]
-            else:
-                forget_rate = 0.0
-            entry["forget_rate"] = forget_rate
-            per_item_stats.append(entry)
+DASHBOARD_FIELDS = ("predictions", "checklist", "insights", "today_context", "model_metrics")
 
-        top_forgotten = sorted(per_item_stats, key=lambda x: x["forget_rate"], reverse=True)
-        metrics = load_model_metrics(current_user.id)
 
-        today = dt.date.today()
-        ctx = (
-            db.query(models.DayContext)
-            .filter(models.DayContext.user_id == current_user.id,
-                    models.DayContext.date == today)
-            .first()
+@app.route("/api/dashboard")
+@login_required
+@conditional_json(uses_model=True)
+def api_dashboard():
+    """
+    Everything the dashboard needs in one round trip. Today's context and
+    the active items are loaded once and shared by all parts.
+    ?fields=predictions,checklist,today_context,model_metrics,insights
+    selects parts (default: all); "insights" includes the full per-item
+    history scan, the others are cheap.
+    """
+    fields = request.args.get("fields")
+    fields = set(fields.split(",")) if fields else set(DASHBOARD_FIELDS)
+    unknown = fields - set(DASHBOARD_FIELDS)
+    if unknown:
+        return jsonify({"error": f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+
+    db = get_session()
+    try:
+        today = user_today()
+        ctx = get_or_create_today_context(db, current_user.id, today)
+        out = {"date": str(today)}
+
+        if fields & {"predictions", "checklist"}:
+            items = active_items(db, current_user.id)
+            if "predictions" in fields:
+                out["predictions"] = build_predictions(db, current_user.id, ctx, items)
+            if "checklist" in fields:
+                out["checklist"] = build_checklist(db, current_user.id, ctx, items)
+        if "insights" in fields:
+            out["insights"] = build_insights(db, current_user.id, ctx)
+        if "today_context" in fields:
+            out["today_context"] = build_today_context(ctx)
+        if "model_metrics" in fields:
+            from ml import load_model_metrics
+            out["model_metrics"] = load_model_metrics(current_user.id)
+        return jsonify(out)
+    finally:
+        db.close()
+
+# ----------------- HISTORY API (KEYSET PAGINATION) ----------------- #
+
+def _parse_history_cursor(raw: str):
+    """Cursor format: "<YYYY-MM-DD>:<context_id>" (last day of the previous page)."""
+    date_str, _, ctx_id = raw.rpartition(":")
+    return dt.date.fromisoformat(date_str), int(ctx_id)
+
+
+@app.route("/api/history")
+@login_required
+def api_history():
+    """
+    Past days (DayContext + DailyItemStatus rows), newest first.
+    Query params:
+      start, end  -- inclusive date range (YYYY-MM-DD), both optional
+      limit       -- days per page (default HISTORY_PAGE_SIZE)
+      cursor      -- next_cursor from the previous page
+    Pages are selected by keyset on (date, id), so any page costs the same,
+    and the response is streamed day by day.
+    """
+    try:
+        start = dt.date.fromisoformat(request.args["start"]) if request.args.get("start") else None
+        end = dt.date.fromisoformat(request.args["end"]) if request.args.get("end") else None
+        limit = min(max(request.args.get("limit", HISTORY_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+        cursor = _parse_history_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+    except ValueError:
+        return jsonify({"error": "Invalid start, end or cursor"}), 400
+
+    db = get_session()
+    try:
+        q = db.query(models.DayContext).filter(models.DayContext.user_id == current_user.id)
+        if start:
+            q = q.filter(models.DayContext.date >= start)
+        if end:
+            q = q.filter(models.DayContext.date <= end)
+        if cursor:
+            c_date, c_id = cursor
+            q = q.filter(or_(
+                models.DayContext.date < c_date,
+                and_(models.DayContext.date == c_date, models.DayContext.id < c_id),
+            ))
+        contexts = (
+            q.order_by(models.DayContext.date.desc(), models.DayContext.id.desc())
+            .limit(limit + 1)
+            .all()
         )
-        today_ctx = None
-        if ctx:
-            day_type = "Weekend" if ctx.weekday >= 5 else "Weekday"
-            today_ctx = {
-                "date": str(ctx.date),
-                "weekday": ctx.weekday,
-                "day_type": day_type,
-                "has_work_event": bool(ctx.has_work_event),
-                "has_gym_event": bool(ctx.has_gym_event),
-            }
+    except Exception:
+        db.close()
+        raise
+    has_more = len(contexts) > limit
+    contexts = contexts[:limit]
+    next_cursor = f"{contexts[-1].date.isoformat()}:{contexts[-1].id}" if has_more else None
+
+    def generate():
+        try:
+            rows = (
+                db.query(models.DailyItemStatus, models.Item.name)
+                .join(models.Item, models.Item.id == models.DailyItemStatus.item_id)
+                .filter(models.DailyItemStatus.context_id.in_([c.id for c in contexts]))
+                .order_by(models.DailyItemStatus.context_id, models.DailyItemStatus.item_id)
+                .yield_per(500)
+            )
+            by_context = defaultdict(list)
+            for st, name in rows:
+                by_context[st.context_id].append({
+                    "item_id": st.item_id,
+                    "name": name,
+                    "packed": bool(st.packed),
+                    "needed_label": st.needed_label,
+                    "reminder_sent": bool(st.reminder_sent),
+                })
+
+            yield '{"days": ['
+            for i, ctx in enumerate(contexts):
+                day = {
+                    "context_id": ctx.id,
+                    "date": str(ctx.date),
+                    "weekday": ctx.weekday,
+                    "is_holiday": bool(ctx.is_holiday),
+                    "has_work_event": bool(ctx.has_work_event),
+                    "has_gym_event": bool(ctx.has_gym_event),
+                    "items": by_context.pop(ctx.id, []),
+                }
+                yield ("," if i else "") + json.dumps(day)
+            yield "], " + json.dumps({"next_cursor": next_cursor})[1:]
+        finally:
+            db.close()
 
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+@app.route("/api/export")
+@login_required
+def api_export():
+    """
+    Download the logged-in user's full history, streamed:
+      /api/export?format=csv      (same schema as seed_from_csv.py)
+      /api/export?format=parquet  (needs pyarrow)
+    All-user exports are CLI-only: python export.py
+    """
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "parquet"):
+        return jsonify({"error": "format must be csv or parquet"}), 400
+
+    user_id = current_user.id
+    db = get_session()
+
+    def generate():
+        try:
+            batches = iter_history_rows(db, user_id)
+            if fmt == "csv":
+                for chunk in iter_csv(batches):
+                    yield chunk
+            else:
+                for chunk in iter_parquet(batches):
+                    yield chunk
+        finally:
+            db.close()
+
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            db.close()
+            return jsonify({"error": "Parquet export is not available on this server"}), 501
+
+    mimetype = "text/csv" if fmt == "csv" else "application/vnd.apache.parquet"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=history_{user_id}.{fmt}"},
+    )
+
+
+# ----------------- REMINDER PREFERENCES ----------------- #
+
+def _round_to_slot(t: dt.time) -> dt.time:
+    """Round a reminder time down to its REMINDER_SLOT_MINUTES slot."""
+    minutes = t.hour * 60 + t.minute
+    minutes -= minutes % REMINDER_SLOT_MINUTES
+    return dt.time(minutes // 60, minutes % 60)
+
+
+@app.route("/api/preferences", methods=["GET", "POST"])
+@login_required
+def api_preferences():
+    db = get_session()
+    try:
+        user = db.query(models.User).filter(models.User.id == current_user.id).first()
+
+        if request.method == "POST":
+            data = request.get_json() or {}
+            if "timezone" in data:
+                tz_name = data.get("timezone") or None
+                if tz_name:
+                    try:
+                        ZoneInfo(tz_name)
+                    except (ZoneInfoNotFoundError, ValueError):
+                        return jsonify({"error": "Unknown timezone"}), 400
+                user.timezone = tz_name
+            if "reminder_time" in data:
+                raw = data.get("reminder_time")
+                if raw:
+                    try:
+                        user.reminder_time = _round_to_slot(dt.time.fromisoformat(raw))
+                    except (TypeError, ValueError):
+                        return jsonify({"error": "Invalid reminder_time, expected HH:MM"}), 400
+                else:
+                    user.reminder_time = None
+            db.commit()
+
+        reminder_time = user.reminder_time or DEFAULT_REMINDER_TIME
         return jsonify({
-            "per_item_stats": per_item_stats,
-            "top_forgotten": top_forgotten,
-            "model_metrics": metrics,
-            "today_context": today_ctx,
+            "timezone": user.timezone,
+            "reminder_time": reminder_time.strftime("%H:%M"),
         })
     finally:
         db.close()
 
+
 @app.route("/api/train_global", methods=["POST"])
 def api_train_global():
     """
     Train a GLOBAL model across all users.
     Use this after seeding/importing data or periodically.
     """
+    from ml import train_global_models
     db = SessionLocal()
     try:
         ok = train_global_models(db)
         if not ok:
             return jsonify({"status": "error", "message": "Not enough global data to train model"}), 400
+        global_model_updated(db)
         return jsonify({"status": "trained"})
     finally:
         db.close()
@@ -674,6 +1391,11 @@ def email_mark_packed():
             if st.needed_label is None:
                 st.needed_label = True
 
+        refresh_features(db, models.DailyItemStatus.user_id == user_id,
+                         models.DailyItemStatus.context_id == ctx.id)
+        bump_checklist_version(db, ctx.id)
+        mark_labels_changed(db, user_id)
+        bump_data_version(db, models.User.id == user_id)
         db.commit()
         flash("Marked today's items as packed from your email reminder.", "success")
     finally:
@@ -683,134 +1405,643 @@ def email_mark_packed():
 
 # ----------------- DAILY EMAIL SCHEDULER ----------------- #
 
-def send_daily_reminders():
+def get_reminder_template():
+    """Compiled Jinja template for the reminder email (compiled once, then cached)."""
+    global _reminder_template
+    if _reminder_template is None:
+        _reminder_template = app.jinja_env.get_template(REMINDER_TEMPLATE)
+    return _reminder_template
+
+
+_reminder_template = None
+
+
+def _claim_reminder(db: Session, user_id: int, date: dt.date):
     """
-    Runs at 8 AM daily (server time).
-    For each user:
-      - compute today's predictions
-      - send email with summary and one-click packed link
+    Claim the (user, date) reminder work unit.
+    Returns the ReminderLog row, or None if it was already queued/sent,
+    has used up its attempts, or is being handled by another worker.
+    """
+    log = (
+        db.query(models.ReminderLog)
+        .filter(models.ReminderLog.user_id == user_id,
+                models.ReminderLog.date == date)
+        .first()
+    )
+    if log is None:
+        log = models.ReminderLog(user_id=user_id, date=date, status="pending", attempts=0)
+        db.add(log)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return None
+    elif log.status in REMINDER_DONE_STATUSES or log.attempts >= REMINDER_MAX_ATTEMPTS:
+        return None
+
+    log.attempts += 1
+    log.updated_at = dt.datetime.now()
+    db.commit()
+    return log
+
+
+def _fail_reminder(db: Session, user_id: int, date: dt.date, error: Exception):
+    db.rollback()
+    try:
+        (
+            db.query(models.ReminderLog)
+            .filter(models.ReminderLog.user_id == user_id,
+                    models.ReminderLog.date == date)
+            .update({"status": "failed", "error": str(error)[:500],
+                     "updated_at": dt.datetime.now()},
+                    synchronize_session=False)
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+
+
+def predict_reminder_for_user(user_id: int, date: dt.date):
+    """
+    Prediction stage for one user. Runs in its own session so a failure
+    for one user never aborts the others.
+    Returns (outcome, payload) where outcome is "predicted", "skipped"
+    or "failed", and payload holds what the render stage needs.
     """
     db = SessionLocal()
-    
     try:
-        # OPTIONAL: keep the global model up-to-date once per day
+        if _claim_reminder(db, user_id, date) is None:
+            return "skipped", None
+
+        user = db.query(models.User).filter(models.User.id == user_id).first()
+        ctx = get_or_create_today_context(db, user_id, date)
+        preds = build_predictions(db, user_id, ctx, active_items(db, user_id))
+        events.notify(user_id)  # today's snapshot is ready
+        # keep top 5 most important
+        top_preds = [p for p in preds if p["need_probability"] > 0.5][:5]
+
+        return "predicted", {
+            "user_id": user_id,
+            "email": user.email,
+            "date": date,
+            "context_id": ctx.id,
+            "top_preds": top_preds,
+        }
+    except Exception as e:
+        print(f"[SCHEDULER ERROR] Reminder for user {user_id} failed: {e}")
+        _fail_reminder(db, user_id, date, e)
+        return "failed", None
+    finally:
+        db.close()
+
+
+def render_reminder_batch(db: Session, payloads: list) -> int:
+    """
+    Render stage: turn a batch of precomputed predictions into outbox rows,
+    mark the work units as queued and flag the reminded items, in one commit.
+    """
+    if not payloads:
+        return 0
+
+    template = get_reminder_template()
+    now = dt.datetime.now()
+    for p in payloads:
+        date_str = p["date"].isoformat()
+        token = generate_email_token(p["user_id"], date_str)
+        html_body = template.render(
+            date_str=date_str,
+            top_preds=p["top_preds"],
+            app_base_url=APP_BASE_URL,
+            mark_packed_link=f"{APP_BASE_URL}/email/mark_packed?user={p['user_id']}&date={date_str}&token={token}",
+        )
+        db.add(models.EmailOutbox(
+            user_id=p["user_id"],
+            date=p["date"],
+            kind="daily_reminder",
+            to_email=p["email"],
+            subject="Your daily packing reminder",
+            html_body=html_body,
+            status="queued",
+            attempts=0,
+            created_at=now,
+            updated_at=now,
+        ))
+
+        (
+            db.query(models.ReminderLog)
+            .filter(models.ReminderLog.user_id == p["user_id"],
+                    models.ReminderLog.date == p["date"])
+            .update({"status": "queued", "error": None, "updated_at": now},
+                    synchronize_session=False)
+        )
+
+    # Remember which items were part of the reminder
+    reminded = {(p["context_id"], pred["item_id"]): p["user_id"]
+                for p in payloads for pred in p["top_preds"]}
+    if reminded:
+        existing = (
+            db.query(models.DailyItemStatus)
+            .filter(models.DailyItemStatus.context_id.in_({ctx_id for ctx_id, _ in reminded}))
+            .all()
+        )
+        for st in existing:
+            if reminded.pop((st.context_id, st.item_id), None) is not None:
+                st.reminder_sent = True
+        for (ctx_id, item_id), user_id in reminded.items():
+            db.add(models.DailyItemStatus(
+                user_id=user_id,
+                item_id=item_id,
+                context_id=ctx_id,
+                reminder_sent=True,
+            ))
+
+    db.commit()
+    return len(payloads)
+
+
+def _column_matches(column, value):
+    return column.is_(None) if value is None else column == value
+
+
+def pending_reminder_user_ids(db: Session, date: dt.date, timezone=None, reminder_time=None) -> list:
+    """
+    Users of one time slot (timezone + reminder_time, as stored) who still
+    need a reminder for their local `date` (not sent, attempts left).
+    """
+    rows = (
+        db.query(models.User.id)
+        .outerjoin(
+            models.ReminderLog,
+            and_(models.ReminderLog.user_id == models.User.id,
+                 models.ReminderLog.date == date),
+        )
+        .filter(
+            _column_matches(models.User.timezone, timezone),
+            _column_matches(models.User.reminder_time, reminder_time),
+            or_(
+                models.ReminderLog.id == None,
+                and_(models.ReminderLog.status.notin_(REMINDER_DONE_STATUSES),
+                     models.ReminderLog.attempts < REMINDER_MAX_ATTEMPTS),
+            ),
+        )
+        .order_by(models.User.id)
+        .all()
+    )
+    return [uid for (uid,) in rows]
+
+
+def due_reminder_slots(db: Session) -> list:
+    """
+    Group users into (timezone, reminder_time) slots and return the slots
+    whose local reminder time passed less than REMINDER_CATCHUP_MINUTES
+    ago, with the local date that reminder is for (yesterday's, when the
+    window runs past midnight).
+    """
+    due = []
+    window = dt.timedelta(minutes=REMINDER_CATCHUP_MINUTES)
+    slots = db.query(models.User.timezone, models.User.reminder_time).distinct().all()
+    for tz_name, reminder_time in slots:
+        now = local_now(tz_name)
+        for date in (now.date(), now.date() - dt.timedelta(days=1)):
+            at = dt.datetime.combine(date, reminder_time or DEFAULT_REMINDER_TIME, tzinfo=now.tzinfo)
+            if at <= now < at + window:
+                due.append((tz_name, reminder_time, date))
+                break
+    return due
+
+
+def run_reminder_batches(user_ids: list, date: dt.date) -> list:
+    """
+    Predict and render reminders in batches of REMINDER_BATCH_SIZE users.
+    Predictions run REMINDER_WORKERS users in parallel; each batch is then
+    rendered into the outbox in one transaction. Returns per-batch timing stats.
+    """
+    batch_stats = []
+    with ThreadPoolExecutor(max_workers=REMINDER_WORKERS) as pool:
+        for start in range(0, len(user_ids), REMINDER_BATCH_SIZE):
+            batch = user_ids[start:start + REMINDER_BATCH_SIZE]
+
+            t0 = time.perf_counter()
+            results = list(pool.map(lambda uid: predict_reminder_for_user(uid, date), batch))
+            predict_seconds = time.perf_counter() - t0
+            outcomes = Counter(outcome for outcome, _ in results)
+            payloads = [payload for outcome, payload in results if outcome == "predicted"]
+
+            t1 = time.perf_counter()
+            db = SessionLocal()
+            try:
+                queued = render_reminder_batch(db, payloads)
+            except Exception as e:
+                print(f"[SCHEDULER ERROR] Rendering batch failed: {e}")
+                for p in payloads:
+                    _fail_reminder(db, p["user_id"], p["date"], e)
+                queued = 0
+            finally:
+                db.close()
+            render_seconds = time.perf_counter() - t1
+
+            stats = {
+                "batch": len(batch_stats) + 1,
+                "users": len(batch),
+                "queued": queued,
+                "skipped": outcomes["skipped"],
+                "failed": outcomes["failed"] + len(payloads) - queued,
+                "predict_seconds": round(predict_seconds, 3),
+                "render_seconds": round(render_seconds, 3),
+            }
+            batch_stats.append(stats)
+            print(
+                f"[SCHEDULER] Batch {stats['batch']}: {stats['users']} users "
+                f"(queued={stats['queued']}, skipped={stats['skipped']}, failed={stats['failed']}); "
+                f"predict {predict_seconds:.2f}s, render {render_seconds:.2f}s"
+            )
+    return batch_stats
+
+
+# ----------------- EMAIL DELIVERY (OUTBOX) ----------------- #
+
+def _claim_outbox_batch(db: Session, limit: int) -> list:
+    """
+    Claim up to `limit` deliverable outbox rows for this worker.
+    Failed rows are retried after a minute; rows stuck in "sending"
+    (e.g. after a crash) are reclaimed after OUTBOX_STALE_MINUTES.
+    """
+    now = dt.datetime.now()
+    deliverable = and_(
+        models.EmailOutbox.attempts < REMINDER_MAX_ATTEMPTS,
+        or_(
+            models.EmailOutbox.status == "queued",
+            and_(models.EmailOutbox.status == "failed",
+                 models.EmailOutbox.updated_at < now - dt.timedelta(minutes=1)),
+            and_(models.EmailOutbox.status == "sending",
+                 models.EmailOutbox.updated_at < now - dt.timedelta(minutes=OUTBOX_STALE_MINUTES)),
+        ),
+    )
+    ids = [
+        oid for (oid,) in db.query(models.EmailOutbox.id)
+        .filter(deliverable)
+        .order_by(models.EmailOutbox.id)
+        .limit(limit)
+        .all()
+    ]
+    if not ids:
+        return []
+
+    claim = f"{instance_id()}:{time.monotonic_ns()}"
+    (
+        db.query(models.EmailOutbox)
+        .filter(models.EmailOutbox.id.in_(ids), deliverable)
+        .update({"status": "sending", "claimed_by": claim, "updated_at": now,
+                 "attempts": models.EmailOutbox.attempts + 1},
+                synchronize_session=False)
+    )
+    db.commit()
+    return [
+        oid for (oid,) in db.query(models.EmailOutbox.id)
+        .filter(models.EmailOutbox.claimed_by == claim)
+        .all()
+    ]
+
+
+def deliver_outbox_email(outbox_id: int) -> str:
+    """Send one claimed outbox row. Returns "sent" or "failed"."""
+    db = SessionLocal()
+    try:
+        msg = db.query(models.EmailOutbox).filter(models.EmailOutbox.id == outbox_id).first()
         try:
-            trained = train_global_models(db)
-            if trained:
-                print("[SCHEDULER] Global model retrained successfully.")
-            else:
-                print("[SCHEDULER] Not enough global data to retrain model yet.")
+            send_email(msg.to_email, msg.subject, msg.html_body)
         except Exception as e:
-            print(f"[SCHEDULER] Global training failed: {e}")
+            print(f"[EMAIL ERROR] Outbox {outbox_id} to {msg.to_email} failed: {e}")
+            msg.status = "failed"
+            msg.error = str(e)[:500]
+            msg.updated_at = dt.datetime.now()
+            db.commit()
+            return "failed"
 
-        today = dt.date.today()
-        users = db.query(models.User).all()
-        if not users:
-            print("[SCHEDULER] No users yet; skipping reminder.")
-            return
+        msg.status = "sent"
+        msg.error = None
+        msg.sent_at = msg.updated_at = dt.datetime.now()
+        db.commit()
+        return "sent"
+    finally:
+        db.close()
 
-        for user in users:
-            ctx = (
-                db.query(models.DayContext)
-                .filter(models.DayContext.user_id == user.id,
-                        models.DayContext.date == today)
-                .first()
-            )
-            if not ctx:
-                ctx = models.DayContext(
-                    user_id=user.id,
-                    date=today,
-                    weekday=today.weekday(),
-                    is_holiday=False,
-                    has_work_event=False,
-                    has_gym_event=False,
-                )
-                db.add(ctx)
-                db.commit()
-                db.refresh(ctx)
 
-            context_features = {
-                "weekday": ctx.weekday,
-                "is_holiday": int(ctx.is_holiday),
-                "has_work_event": int(ctx.has_work_event),
-                "has_gym_event": int(ctx.has_gym_event),
-            }
+def deliver_outbox() -> dict:
+    """
+    Delivery stage: drain the outbox with EMAIL_WORKERS parallel senders,
+    OUTBOX_BATCH_SIZE rows per claim.
+    """
+    totals = Counter()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=EMAIL_WORKERS) as pool:
+        while True:
+            db = SessionLocal()
+            try:
+                ids = _claim_outbox_batch(db, OUTBOX_BATCH_SIZE)
+            finally:
+                db.close()
+            if not ids:
+                break
+            totals.update(pool.map(deliver_outbox_email, ids))
+
+    elapsed = time.perf_counter() - t0
+    delivered = totals["sent"] + totals["failed"]
+    if delivered:
+        print(
+            f"[EMAIL] Delivered {totals['sent']} sent, {totals['failed']} failed "
+            f"in {elapsed:.2f}s ({delivered / max(elapsed, 1e-6):.1f} msg/s)"
+        )
+    return dict(totals)
 
-            items = (
-                db.query(models.Item)
-                .filter(models.Item.user_id == user.id,
-                        models.Item.active == True)
-                .all()
-            )
-            item_dicts = [
-                {"id": it.id, "name": it.name, "priority": it.priority}
-                for it in items
-            ]
-
-            preds = predict_items_for_today(user.id, context_features, item_dicts)
-            # keep top 5 most important
-            top_preds = [p for p in preds if p["need_probability"] > 0.5][:5]
-
-            date_str = today.isoformat()
-            token = generate_email_token(user.id, date_str)
-            link = f"{APP_BASE_URL}/email/mark_packed?user={user.id}&date={date_str}&token={token}"
-
-            items_html = ""
-            if top_preds:
-                items_html = "<ul>"
-                for p in top_preds:
-                    items_html += (
-                        f"<li><strong>{p['name']}</strong> "
-                        f"(Need: {p['need_probability']*100:.0f}%, "
-                        f"Forget risk: {p['forget_risk']*100:.0f}%)</li>"
-                    )
-                items_html += "</ul>"
-            else:
-                items_html = "<p>No specific items predicted today. Check your checklist in the app.</p>"
-
-            html_body = f"""
-            <html>
-            <body>
-              <p>Good morning 👋,</p>
-              <p>Here are the top items you usually need today ({date_str}):</p>
-              {items_html}
-              <p>
-                <a href="{APP_BASE_URL}" style="padding:8px 14px; background:#2563eb; color:#fff; text-decoration:none; border-radius:4px;">
-                  Open Daily Task Memory Assistant
-                </a>
-              </p>
-              <p>
-                If you've already packed, you can mark everything as packed for today with one click:
-              </p>
-              <p>
-                <a href="{link}" style="padding:8px 14px; background:#16a34a; color:#fff; text-decoration:none; border-radius:4px;">
-                  Yes, I’ve packed everything ✅
-                </a>
-              </p>
-              <p style="font-size:12px; color:#6b7280;">
-                This link is unique for today and will update your packing history.
-              </p>
-            </body>
-            </html>
-            """
-
-            send_email(user.email, "Your daily packing reminder", html_body)
 
+def send_daily_reminders():
+    """
+    Runs on every REMINDER_SLOT_MINUTES boundary (and once at startup).
+    For each time slot that is due, for each user in it who has not been
+    emailed yet on their local date:
+      - compute today's predictions
+      - render the email with summary and one-click packed link into the outbox
+    then drains the outbox. Progress is stored per user in ReminderLog, so
+    re-running never re-sends and an interrupted run resumes on the next tick.
+    """
+    db = SessionLocal()
+    try:
+        work = []
+        for tz_name, reminder_time, local_date in due_reminder_slots(db):
+            user_ids = pending_reminder_user_ids(db, local_date, tz_name, reminder_time)
+            if user_ids:
+                ensure_day_contexts(db, local_date, models.User.id.in_(user_ids))
+                work.append((tz_name, reminder_time, local_date, user_ids))
+    finally:
+        db.close()
+
+    if not work:
+        return
+
+    for tz_name, reminder_time, local_date, user_ids in work:
+        slot = f"{tz_name or 'server time'} @ {(reminder_time or DEFAULT_REMINDER_TIME):%H:%M}"
+        t0 = time.perf_counter()
+        batch_stats = run_reminder_batches(user_ids, local_date)
+        queued = sum(b["queued"] for b in batch_stats)
+        failed = sum(b["failed"] for b in batch_stats)
+        print(
+            f"[SCHEDULER] Slot {slot}: {queued} queued, {failed} failed, "
+            f"{len(batch_stats)} batches in {time.perf_counter() - t0:.2f}s"
+        )
+
+    deliver_outbox()
+
+
+def prepare_day_contexts():
+    """
+    Morning pre-pass: create today's DayContext for every user, per timezone,
+    so request handlers only ever read it. Runs hourly so each timezone is
+    covered shortly after its local midnight; a no-op once rows exist.
+    """
+    db = SessionLocal()
+    try:
+        created = 0
+        for (tz_name,) in db.query(models.User.timezone).distinct().all():
+            local_date = local_now(tz_name).date()
+            created += ensure_day_contexts(db, local_date, _column_matches(models.User.timezone, tz_name))
+        if created:
+            print(f"[SCHEDULER] Created {created} day contexts.")
+
+        cutoff = dt.date.today() - dt.timedelta(days=PREDICTION_SNAPSHOT_DAYS)
+        db.query(models.DailyPrediction).filter(models.DailyPrediction.date < cutoff).delete(
+            synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[SCHEDULER] Day context pre-pass failed: {e}")
+    finally:
+        db.close()
+
+
+def retrain_global_model():
+    """Runs once a day, ahead of the default reminder slot."""
+    from ml import train_global_models
+    db = SessionLocal()
+    try:
+        trained = train_global_models(db)
+        if trained:
+            print("[SCHEDULER] Global model retrained successfully.")
+            global_model_updated(db)
+        else:
+            print("[SCHEDULER] Not enough global data to retrain model yet.")
+    except Exception as e:
+        print(f"[SCHEDULER] Global training failed: {e}")
+    finally:
+        db.close()
+
+
+def global_model_updated(db: Session):
+    """
+    Residual offsets were fitted against the previous global model:
+    queue those users for a refit, then tell open clients.
+    """
+    from ml import residual_user_ids
+    request_refits(db, residual_user_ids())
+    db.commit()
+    events.notify_all()
+
+
+def train_and_record(db: Session, user_id: int) -> bool:
+    """Train the user's personal model and note what it was fitted on."""
+    from ml import train_models_for_user
+    started_at = dt.datetime.utcnow()
+    labels = labelled_row_count(db, user_id)
+    ok = train_models_for_user(db, user_id)
+    if ok:
+        record_training(db, user_id, labels, started_at)
+        events.notify(user_id)
+    return ok
+
+
+def retrain_due_models():
+    """
+    Retrain personal models whose users gained enough new labels and
+    have been quiet for the debounce period (see retrain_queue.py).
+    """
+    from ml import PREDICTOR
+    if PREDICTOR == "counts":
+        return  # the count tables are always current
+    db = SessionLocal()
+    try:
+        user_ids = due_retrains(db)
+        for user_id in user_ids:
+            try:
+                trained = train_and_record(db, user_id)
+                print(f"[SCHEDULER] Retrained model for user {user_id}: {'ok' if trained else 'not enough data'}")
+            except Exception as e:
+                db.rollback()
+                print(f"[SCHEDULER] Retraining for user {user_id} failed: {e}")
+    finally:
+        db.close()
+
+
+# ----------------- LEADER ELECTION ----------------- #
+
+def is_scheduler_leader() -> bool:
+    """Acquire/renew the scheduler lease; True if this process holds it."""
+    db = SessionLocal()
+    try:
+        return try_acquire_lease(db, SCHEDULER_LEASE_NAME, instance_id(), SCHEDULER_LEASE_SECONDS)
     except Exception as e:
-        print(f"[SCHEDULER ERROR] {e}")
+        print(f"[SCHEDULER] Lease check failed: {e}")
+        return False
     finally:
         db.close()
 
 
+def leader_only(job):
+    """
+    Wrap a scheduled job so it only runs in the process that holds
+    the scheduler lease. Every worker schedules the job; the others no-op.
+    """
+    @functools.wraps(job)
+    def wrapper(*args, **kwargs):
+        if not is_scheduler_leader():
+            return None
+        return job(*args, **kwargs)
+    return wrapper
+
+
+def release_scheduler_lease():
+    db = SessionLocal()
+    try:
+        release_lease(db, SCHEDULER_LEASE_NAME, instance_id())
+    except Exception as e:
+        print(f"[SCHEDULER] Could not release lease: {e}")
+    finally:
+        db.close()
+
+
+def shutdown_scheduler():
+    scheduler.shutdown()
+    release_scheduler_lease()
+
+
 scheduler = BackgroundScheduler()
-# runs daily at 8:00
-scheduler.add_job(send_daily_reminders, "cron", hour=8, minute=0)
-#runs every 2mins
-# runs daily at 8:00
-# scheduler.add_job(send_daily_reminders, "interval", minutes=5)
-scheduler.start()
-atexit.register(lambda: scheduler.shutdown())
+
+
+def schedule_jobs():
+    """Register the background jobs; first runs are timed from now."""
+    # keep the lease alive while this process is leader (and take over if the leader died)
+    scheduler.add_job(is_scheduler_leader, "interval", seconds=max(SCHEDULER_LEASE_SECONDS // 3, 1),
+                      next_run_time=dt.datetime.now())
+    # create each user's DayContext ahead of their first request of the day
+    scheduler.add_job(leader_only(prepare_day_contexts), "cron", minute=1,
+                      next_run_time=dt.datetime.now() + dt.timedelta(seconds=5))
+    # retry/drain anything left in the outbox
+    scheduler.add_job(leader_only(deliver_outbox), "interval", minutes=1)
+    # retrain personal models after bursts of new labels have settled
+    scheduler.add_job(leader_only(retrain_due_models), "interval",
+                      seconds=max(RETRAIN_DEBOUNCE_SECONDS // 5, 30), max_instances=1, coalesce=True)
+    # keep the global model up-to-date once per day
+    scheduler.add_job(leader_only(retrain_global_model), "cron", hour=GLOBAL_RETRAIN_HOUR, minute=0)
+    # process reminder slots on their boundaries; the first run at startup
+    # resumes anything an earlier crash/restart left unsent (within
+    # REMINDER_CATCHUP_MINUTES)
+    scheduler.add_job(leader_only(send_daily_reminders), "cron", minute=f"*/{REMINDER_SLOT_MINUTES}",
+                      next_run_time=dt.datetime.now() + dt.timedelta(seconds=5))
+
+
+# ----------------- APP FACTORY ----------------- #
+
+_initialized = False
+_warmup_lock = threading.Lock()
+_warmup_started = False
+
+
+def merge_duplicate_day_contexts():
+    """
+    Fold duplicate (user, date) contexts, left by the create race from
+    before uq_day_contexts_user_date existed, into the oldest one so the
+    unique index can be created.
+    """
+    ctx = models.DayContext.__table__
+    with engine.begin() as conn:
+        groups = conn.execute(
+            select(func.min(ctx.c.id), ctx.c.user_id, ctx.c.date)
+            .group_by(ctx.c.user_id, ctx.c.date)
+            .having(func.count() > 1)
+        ).all()
+        for keep_id, user_id, date in groups:
+            duplicates = select(ctx.c.id).where(ctx.c.user_id == user_id, ctx.c.date == date,
+                                                ctx.c.id != keep_id)
+            for table in (models.DailyItemStatus.__table__, models.TrainingFeature.__table__):
+                conn.execute(update(table).where(table.c.context_id.in_(duplicates)).values(context_id=keep_id))
+            conn.execute(ctx.delete().where(ctx.c.id.in_(duplicates)))
+        if groups:
+            print(f"[DB] Merged duplicate day contexts for {len(groups)} user-days")
+
+
+def init_database():
+    """Create missing tables/columns/indexes and backfill derived tables."""
+    Base.metadata.create_all(bind=engine)
+    ensure_columns()
+    merge_duplicate_day_contexts()
+    ensure_indexes()
+    db = SessionLocal()
+    try:
+        ensure_feature_store(db)
+        ensure_online_counts(db)
+    finally:
+        db.close()
+
+
+def warm_models():
+    """Load the most used models into this process's cache (see ml.warm_model_cache)."""
+    from ml import warm_model_cache
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        cached = warm_model_cache(db)
+        print(f"[WARMUP] {cached} model files cached in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print(f"[WARMUP] Model warm-up failed: {e}")
+    finally:
+        db.close()
+
+
+def start_model_warmup():
+    """Warm the model cache in a background thread, once per process."""
+    global _warmup_started
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    threading.Thread(target=warm_models, name="model-warmup", daemon=True).start()
+
+
+def start_background_jobs():
+    schedule_jobs()
+    scheduler.start()
+    atexit.register(shutdown_scheduler)
+
+
+def create_app(start_scheduler: bool = True, warm: bool = MODEL_WARMUP) -> Flask:
+    """
+    Prepare the database, warm the model cache (if `warm`) and start the
+    background scheduler, once per process. Importing this module has no
+    side effects; servers call this (e.g. `gunicorn "app:create_app()"`).
+    See gunicorn.conf.py for warming once in the master before forking.
+    """
+    global _initialized, _warmup_started
+    if not _initialized:
+        init_database()
+        if warm:
+            _warmup_started = True
+            warm_models()
+        if start_scheduler:
+            start_background_jobs()
+        _initialized = True
+    return app
+
 
 if __name__ == "__main__":
     # run without debug reloader so scheduler doesn't double-run
-    app.run(debug=False)
\ No newline at end of file
+    create_app().run(debug=False)
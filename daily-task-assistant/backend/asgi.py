@@ -0,0 +1,202 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+from database import DATABASE_URL
+import models
+from app import (
+    app as flask_app,
+    create_app,
+    COMPRESS_MIN_BYTES,
+    active_items,
+    build_checklist,
+    build_insights,
+    compute_etag,
+    context_features,
+    get_or_create_today_context,
+    load_prediction_snapshot,
+    local_now,
+    pooled_counts_version,
+    prediction_item_dicts,
+    prediction_snapshot_key,
+    store_prediction_snapshot,
+    uses_prediction_snapshots,
+)
+
+"""
+ASGI serving mode.
+
+Run from backend folder:
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:app --port 5000
+
+The read-only JSON endpoints below are served natively async, using
+async SQLAlchemy sessions (aiosqlite). Model inference is CPU-bound and
+runs in a thread pool, so the event loop never waits on it. Every other
+route goes to the regular Flask app, mounted as WSGI. Compare both modes
+with loadtest.py.
+"""
+
+ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+ML_WORKERS = int(os.environ.get("ML_WORKERS", str(os.cpu_count() or 2)))
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+ml_executor = ThreadPoolExecutor(max_workers=ML_WORKERS, thread_name_prefix="ml")
+
+
+def _session_user_id(request):
+    """Read the logged-in user id from Flask's signed session cookie."""
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(
+            cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds())
+        )
+    except Exception:
+        return None
+    user_id = data.get("_user_id")
+    return int(user_id) if user_id else None
+
+
+def async_json_endpoint(uses_model: bool = False):
+    """
+    Async counterpart of @login_required + @conditional_json: resolves the
+    user from the session cookie, opens an async session and answers
+    If-None-Match with 304 using the same ETags as the Flask endpoints.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            user_id = _session_user_id(request)
+            if user_id is None:
+                return JSONResponse({"error": "Login required"}, status_code=401)
+
+            async with AsyncSessionLocal() as db:
+                user = await db.get(models.User, user_id)
+                if user is None:
+                    return JSONResponse({"error": "Login required"}, status_code=401)
+
+                today = local_now(user.timezone).date()
+                counts_version = await db.run_sync(pooled_counts_version) if uses_model else None
+                etag = compute_etag(handler.__name__, request.url.query, user.id,
+                                    user.data_version, today, uses_model, counts_version)
+                headers = {"ETag": f'W/"{etag}"', "Cache-Control": "private, no-cache"}
+                if etag in request.headers.get("if-none-match", ""):
+                    return Response(status_code=304, headers=headers)
+
+                payload = await handler(request, db, user, today)
+                return JSONResponse(payload, headers=headers)
+        return wrapper
+    return decorator
+
+
+async def _today_context(db, user, today):
+    ctx = (
+        await db.execute(
+            select(models.DayContext)
+            .where(models.DayContext.user_id == user.id,
+                   models.DayContext.date == today)
+            .limit(1)
+        )
+    ).scalars().first()
+    if ctx is None:
+        # normally created by the morning pre-pass; fall back to the sync helper
+        ctx = await db.run_sync(get_or_create_today_context, user.id, today)
+    return ctx
+
+
+@async_json_endpoint()
+async def api_items(request, db, user, today):
+    items = await db.run_sync(active_items, user.id)
+    return [
+        {
+            "id": it.id,
+            "name": it.name,
+            "priority": it.priority,
+            "category": it.category,
+            "active": it.active,
+        }
+        for it in items
+    ]
+
+
+@async_json_endpoint()
+async def api_checklist_today(request, db, user, today):
+    ctx = await _today_context(db, user, today)
+    items = await db.run_sync(active_items, user.id)
+    return await db.run_sync(build_checklist, user.id, ctx, items)
+
+
+@async_json_endpoint(uses_model=True)
+async def api_predict_today(request, db, user, today):
+    ctx = await _today_context(db, user, today)
+    items = await db.run_sync(active_items, user.id)
+    item_dicts = prediction_item_dicts(items)
+    snapshot_key = None  # count-based predictions are not snapshotted
+    if uses_prediction_snapshots():
+        snapshot_key = await db.run_sync(prediction_snapshot_key, user.id, ctx, item_dicts)
+        preds = await db.run_sync(load_prediction_snapshot, user.id, ctx.date, *snapshot_key)
+        if preds is not None:
+            return {"date": str(today), "predictions": preds}
+
+    from ml import predict_items_for_today
+    preds = await asyncio.get_running_loop().run_in_executor(
+        ml_executor, predict_items_for_today, user.id, context_features(ctx), item_dicts
+    )
+    if snapshot_key is not None:
+        try:
+            await db.run_sync(store_prediction_snapshot, user.id, ctx.date, *snapshot_key, preds)
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()  # a concurrent request stored the same snapshot
+    return {"date": str(today), "predictions": preds}
+
+
+@async_json_endpoint(uses_model=True)
+async def api_insights(request, db, user, today):
+    ctx = (
+        await db.execute(
+            select(models.DayContext)
+            .where(models.DayContext.user_id == user.id,
+                   models.DayContext.date == today)
+            .limit(1)
+        )
+    ).scalars().first()
+    return await db.run_sync(build_insights, user.id, ctx)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    create_app()
+    yield
+    ml_executor.shutdown(wait=False)
+    await async_engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/items", api_items),
+        Route("/api/checklist_today", api_checklist_today),
+        Route("/api/predict_today", api_predict_today),
+        Route("/api/insights", api_insights),
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[Middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_BYTES)],
+    lifespan=lifespan,
+)
@@ -0,0 +1,92 @@
+import argparse
+import time
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, f1_score
+
+from database import SessionLocal
+import models
+import ml
+
+"""
+Compare the context-only feature set with the item-identity features
+(hashed item name + category) on a time holdout, and measure
+per-request inference latency for a full item list.
+
+Run from backend folder:
+
+    python benchmark_features.py --holdout-days 30 --repeats 200
+"""
+
+BASELINE_COLUMNS = ml.FEATURE_COLUMNS + ["cluster_label"]
+
+
+def _split(db, holdout_days: int):
+    last = db.execute(select(func.max(models.TrainingFeature.date))).scalar()
+    if last is None:
+        raise SystemExit("No training data; run seed_from_csv.py first")
+    cut = last - timedelta(days=holdout_days)
+    train = ml._read_features(db, ml._feature_query(models.TrainingFeature.date < cut))
+    test = ml._read_features(db, ml._feature_query(models.TrainingFeature.date >= cut))
+
+    clusters = ml._fit_day_clusters(train[ml.DAY_COLUMNS].drop_duplicates().to_numpy(dtype=float))
+    for df in (train, test):
+        df["cluster_label"] = ml._label_rows(df, clusters["centroids"])
+    return train, test, clusters
+
+
+def _request_items(db):
+    """The largest single user's active item list, as passed to predict."""
+    user_id = db.execute(
+        select(models.Item.user_id)
+        .where(models.Item.active.is_(True))
+        .group_by(models.Item.user_id)
+        .order_by(func.count().desc())
+        .limit(1)
+    ).scalar()
+    return [
+        {"id": it.id, "name": it.name, "priority": it.priority, "category": it.category}
+        for it in db.query(models.Item).filter(models.Item.user_id == user_id, models.Item.active.is_(True))
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark item-identity features.")
+    parser.add_argument("--holdout-days", type=int, default=30)
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        train, test, clusters = _split(db, args.holdout_days)
+        items = _request_items(db)
+    finally:
+        db.close()
+
+    context = {"weekday": 2, "is_holiday": 0, "has_work_event": 1, "has_gym_event": 0}
+    print(f"train rows: {len(train)}  holdout rows: {len(test)}  items per request: {len(items)}")
+    for label, columns in (("context only", BASELINE_COLUMNS), ("with item features", ml.MODEL_COLUMNS)):
+        model = RandomForestClassifier(n_estimators=120, random_state=42)
+        t0 = time.perf_counter()
+        model.fit(train[columns], train["needed_label"])
+        fit_s = time.perf_counter() - t0
+        y_pred = model.predict(test[columns])
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeats):
+            _, need_probs, _ = ml._model_probabilities(context, items, clusters, model, model)
+        latency_ms = (time.perf_counter() - t0) / args.repeats * 1000
+
+        print(
+            f"{label:>20}: accuracy {accuracy_score(test['needed_label'], y_pred):.3f}  "
+            f"f1 {f1_score(test['needed_label'], y_pred, zero_division=0):.3f}  "
+            f"fit {fit_s:.2f}s  predict {latency_ms:.1f} ms/request  "
+            f"distinct scores {len(np.unique(np.round(need_probs, 4)))}/{len(items)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+"""
+Measure application startup with `python -X importtime`.
+
+Each stage runs in a fresh interpreter (so nothing is cached between
+runs) and reports the cumulative import time of its top-level modules:
+
+    import app     what a worker pays before serving anything
+    create_app()   plus schema checks (scheduler not started)
+    first predict  plus `ml` (pandas, joblib, unpickled models)
+    train          plus the scikit-learn training modules
+
+Run from backend folder:
+
+    python benchmark_startup.py --repeats 5
+"""
+
+BACKEND_DIR = Path(__file__).parent
+
+STAGES = {
+    "import app": "import app",
+    "create_app()": "import app; app.create_app(start_scheduler=False)",
+    "first predict": (
+        "import app; app.create_app(start_scheduler=False); "
+        "import ml; ml.predict_items_for_today(1, {'weekday': 0, 'is_holiday': 0, "
+        "'has_work_event': 0, 'has_gym_event': 0}, [{'id': 1, 'name': 'Keys', 'priority': 'high'}])"
+    ),
+    "train": "import app; import ml; from sklearn.ensemble import RandomForestClassifier",
+}
+
+
+def run_stage(code: str):
+    """(wall seconds, {top-level module: cumulative import microseconds}) for one fresh run."""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.strip() == "imported package" or not cumulative.strip().isdigit():
+            continue
+        if not name[1:].startswith(" "):  # only modules imported directly by the stage
+            times[name.strip()] = int(cumulative)
+    return time.perf_counter() - started, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time breakdown of app startup.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="slowest modules listed per stage")
+    args = parser.parse_args()
+
+    for stage, code in STAGES.items():
+        runs = [run_stage(code) for _ in range(args.repeats)]
+        wall = statistics.median(w for w, _ in runs)
+        imports = statistics.median(sum(times.values()) / 1e6 for _, times in runs)
+        print(f"{stage:<14} wall {wall:.3f}s, imports {imports:.3f}s (median of {args.repeats})")
+
+        slowest = sorted(runs[-1][1].items(), key=lambda kv: kv[1], reverse=True)[:args.top]
+        for name, micros in slowest:
+            print(f"    {name:<30} {micros / 1e6:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
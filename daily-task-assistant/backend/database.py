@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base, scoped_session
 
 DATABASE_URL = "sqlite:///../app.db"  # DB file at project root
@@ -20,4 +20,43 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def ensure_columns():
+    """
+    Add columns that exist on the models but not yet in the database.
+    create_all() only creates missing tables, so this keeps an existing
+    app.db usable after new (nullable or defaulted) columns are added.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = (
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                    f"{column.type.compile(dialect=engine.dialect)}"
+                )
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    if isinstance(default, str):
+                        default = f"'{default}'"
+                    ddl += f" DEFAULT {default}"
+                conn.execute(text(ddl))
+
+
+def ensure_indexes():
+    """
+    Create indexes declared on the models that are missing from the
+    database (create_all() skips them for tables that already exist).
+    """
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, f1_score
+
+from database import SessionLocal
+import models
+import ml
+
+"""
+Offline evaluation with rolling time-based backtests.
+
+For every user, the history is cut at several points in time: each fold
+trains on all days before the cut and is scored on the next
+`--test-days` days, so no model ever sees its test days. Every
+(user, model config) pair runs in its own process.
+
+Per config the report has accuracy / F1 (averaged over users and folds),
+fit time, predict latency for one day's items, and pickled model size,
+so the smallest/fastest model that holds accuracy can be picked.
+
+Run from backend folder:
+
+    python evaluation.py --folds 4 --test-days 14
+    python evaluation.py --configs rf_100,rf_20_depth8 --out evaluation.json
+
+`--global-sample-sizes` instead compares the global model trained on
+all rows with the one trained on stratified samples of each size
+(GLOBAL_SAMPLE_SIZE), scored on the same held-out recent days:
+
+    python evaluation.py --global-sample-sizes 1000,5000,20000
+"""
+
+BASE_COLUMNS = ml.FEATURE_COLUMNS + ["cluster_label"]
+
+# name -> (model factory, feature columns)
+CONFIGS = {
+    "rf_100": (lambda: RandomForestClassifier(n_estimators=100, random_state=42), ml.MODEL_COLUMNS),
+    "rf_100_context_only": (lambda: RandomForestClassifier(n_estimators=100, random_state=42), BASE_COLUMNS),
+    "rf_50_depth12": (
+        lambda: RandomForestClassifier(n_estimators=50, max_depth=12, random_state=42), ml.MODEL_COLUMNS
+    ),
+    "rf_20_depth8": (
+        lambda: RandomForestClassifier(n_estimators=20, max_depth=8, random_state=42), ml.MODEL_COLUMNS
+    ),
+    "logreg": (lambda: LogisticRegression(max_iter=1000), ml.FORGET_COLUMNS),
+}
+
+
+def rolling_folds(dates: pd.Series, folds: int, test_days: int):
+    """(train_mask, test_mask) pairs, most recent window first."""
+    days = np.sort(dates.unique())
+    for k in range(folds):
+        end = len(days) - k * test_days
+        start = end - test_days
+        if start <= 0:
+            break
+        test = dates.isin(days[start:end]).to_numpy()
+        train = (dates < days[start]).to_numpy()
+        yield train, test
+
+
+def evaluate_config(task):
+    """Backtest one model config on one user's history (runs in a worker process)."""
+    user_id, config_name, df, folds, test_days = task
+    make_model, columns = CONFIGS[config_name]
+
+    scores = []
+    for train, test in rolling_folds(df["date"], folds, test_days):
+        if df["needed_label"][train].nunique() < 2:
+            continue
+        train_df, test_df = df[train].copy(), df[test].copy()
+        clusters = ml._fit_day_clusters(train_df[ml.DAY_COLUMNS].drop_duplicates().to_numpy(dtype=float))
+        for part in (train_df, test_df):
+            part["cluster_label"] = ml._label_rows(part, clusters["centroids"])
+
+        model = make_model()
+        t0 = time.perf_counter()
+        model.fit(train_df[columns], train_df["needed_label"])
+        fit_s = time.perf_counter() - t0
+
+        y_pred = model.predict(test_df[columns])
+
+        # latency of one request: a single day's items
+        day_rows = test_df[test_df["date"] == test_df["date"].iloc[0]][columns]
+        t0 = time.perf_counter()
+        for _ in range(10):
+            model.predict_proba(day_rows)
+        predict_ms = (time.perf_counter() - t0) / 10 * 1000
+
+        scores.append({
+            "accuracy": accuracy_score(test_df["needed_label"], y_pred),
+            "f1": f1_score(test_df["needed_label"], y_pred, zero_division=0),
+            "fit_s": fit_s,
+            "predict_ms": predict_ms,
+            "model_bytes": len(pickle.dumps(model)),
+            "n_train": int(train.sum()),
+            "n_test": int(test.sum()),
+        })
+
+    if not scores:
+        return None
+    summary = {key: float(np.mean([s[key] for s in scores])) for key in scores[0]}
+    summary.update({"user_id": user_id, "config": config_name, "folds": len(scores)})
+    return summary
+
+
+def load_histories(db):
+    """Per-user feature frames (same features the trainers use)."""
+    user_ids = [row.user_id for row in db.query(models.TrainingFeature.user_id).distinct()]
+    return {user_id: ml.load_training_data(db, user_id) for user_id in sorted(user_ids)}
+
+
+def compare_global_sampling(db, sizes):
+    """
+    Global model fitted on all labelled rows vs on stratified samples:
+    each fit uses only pre-holdout rows and is scored on all of the
+    holdout days' rows (HOLDOUT_FRACTION).
+    """
+    full = ml.load_training_counts(db)
+    if full.empty or not full["recent"].any():
+        raise SystemExit("Not enough history to hold out recent days")
+    clusters = ml._fit_day_clusters(full[ml.DAY_COLUMNS].drop_duplicates().to_numpy(dtype=float))
+
+    def prepare(counts):
+        counts["cluster_label"] = ml._label_rows(counts, clusters["centroids"])
+        return ml.weighted_rows(counts, "n_needed")
+
+    X_all, y_all, w_all, recent = prepare(full)
+    X_test, y_test, w_test = X_all[recent], y_all[recent], w_all[recent]
+
+    # (name, rows held in memory, labels they stand for, weighted training rows)
+    variants = [("all", len(full), int(full["n"].sum()), (X_all, y_all, w_all, recent))]
+    for size in sizes:
+        sample = ml.load_training_sample(db, size)
+        variants.append((f"sample_{size}", len(sample), int(sample["n"].sum()), prepare(sample)))
+
+    rows = []
+    for name, rows_held, label_rows, (X, y, w, in_holdout) in variants:
+        train = ~in_holdout
+        t0 = time.perf_counter()
+        model = ml.fit_forest(X[train], y[train], w[train], ml.forest_params(int(w[train].sum())))
+        fit_s = time.perf_counter() - t0
+        y_pred = model.predict(X_test)
+        rows.append({
+            "training": name,
+            "rows_held": rows_held,
+            "label_rows": label_rows,
+            "accuracy": accuracy_score(y_test, y_pred, sample_weight=w_test),
+            "f1": f1_score(y_test, y_pred, sample_weight=w_test, zero_division=0),
+            "fit_s": fit_s,
+        })
+    return pd.DataFrame(rows).set_index("training")
+
+
+def summarize(results):
+    """Average each config's per-user results."""
+    frame = pd.DataFrame(results)
+    return (
+        frame.groupby("config")[["accuracy", "f1", "fit_s", "predict_ms", "model_bytes"]]
+        .mean()
+        .sort_values("f1", ascending=False)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rolling time-based backtests of model configs.")
+    parser.add_argument("--folds", type=int, default=4)
+    parser.add_argument("--test-days", type=int, default=14)
+    parser.add_argument("--configs", default=",".join(CONFIGS), help="comma-separated config names")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--out", help="write per-user results as JSON")
+    parser.add_argument("--global-sample-sizes",
+                        help="comma-separated sample sizes: compare sampled vs full global training")
+    args = parser.parse_args()
+
+    if args.global_sample_sizes:
+        sizes = [int(s) for s in args.global_sample_sizes.split(",") if s.strip()]
+        db = SessionLocal()
+        try:
+            report = compare_global_sampling(db, sizes)
+        finally:
+            db.close()
+        print(report.to_string(float_format=lambda v: f"{v:.3f}"))
+        return
+
+    configs = [c.strip() for c in args.configs.split(",") if c.strip()]
+    unknown = [c for c in configs if c not in CONFIGS]
+    if unknown:
+        parser.error(f"Unknown configs: {', '.join(unknown)} (choose from {', '.join(CONFIGS)})")
+
+    db = SessionLocal()
+    try:
+        histories = load_histories(db)
+    finally:
+        db.close()
+    if not histories:
+        raise SystemExit("No training data; run seed_from_csv.py first")
+
+    tasks = [
+        (user_id, config, df, args.folds, args.test_days)
+        for user_id, df in histories.items()
+        for config in configs
+    ]
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = [r for r in pool.map(evaluate_config, tasks) if r is not None]
+    if not results:
+        raise SystemExit("Not enough history for any fold")
+
+    print(f"{len(histories)} users, {args.folds} folds of {args.test_days} days\n")
+    print(summarize(results).to_string(float_format=lambda v: f"{v:.3f}"))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
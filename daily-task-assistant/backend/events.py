@@ -0,0 +1,75 @@
+import queue
+import threading
+from typing import Dict, Set
+
+"""
+In-process wake-ups for the /api/events streams.
+
+Each open stream subscribes a small queue for its user. Code that
+changes what a user should see (a finished training run, a new
+prediction snapshot) calls notify(), and the stream re-checks and pushes
+right away. Only streams in the same process are woken. Streams held by
+other worker processes notice the same change at their next periodic
+version check (EVENTS_POLL_SECONDS in app.py).
+
+Every open stream holds a server thread, so the number of streams per
+process is capped (open_stream / close_stream).
+"""
+
+_subscribers: Dict[int, Set[queue.Queue]] = {}
+_open_streams = 0
+_lock = threading.Lock()
+
+
+def open_stream(limit: int) -> bool:
+    """Take one of `limit` stream slots in this process; False if all are taken."""
+    global _open_streams
+    with _lock:
+        if _open_streams >= limit:
+            return False
+        _open_streams += 1
+        return True
+
+
+def close_stream():
+    global _open_streams
+    with _lock:
+        _open_streams -= 1
+
+
+def subscribe(user_id: int) -> queue.Queue:
+    q = queue.Queue(maxsize=8)
+    with _lock:
+        _subscribers.setdefault(user_id, set()).add(q)
+    return q
+
+
+def unsubscribe(user_id: int, q: queue.Queue):
+    with _lock:
+        queues = _subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(q)
+            if not queues:
+                del _subscribers[user_id]
+
+
+def _wake(queues):
+    for q in queues:
+        try:
+            q.put_nowait(True)
+        except queue.Full:
+            pass  # a wake-up is already pending
+
+
+def notify(user_id: int):
+    """Wake this user's streams in this process."""
+    with _lock:
+        queues = list(_subscribers.get(user_id, ()))
+    _wake(queues)
+
+
+def notify_all():
+    """Wake every stream in this process (e.g. after a global retrain)."""
+    with _lock:
+        queues = [q for user_queues in _subscribers.values() for q in user_queues]
+    _wake(queues)
@@ -0,0 +1,212 @@
+import argparse
+import csv
+import io
+import sys
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+import models
+
+"""
+Streaming export of packing history.
+
+Rows are written in the same schema seed_from_csv.py reads, so an export
+can be re-imported. Only labelled rows (needed_label set) are exported,
+since the seed script requires a label on every row.
+
+Run from backend folder:
+
+    python export.py --format csv --out history.csv
+    python export.py --format parquet --user demo1@example.com --out demo1.parquet
+"""
+
+EXPORT_COLUMNS = [
+    "user_email",
+    "date",
+    "weekday",
+    "is_holiday",
+    "has_work_event",
+    "has_gym_event",
+    "item_name",
+    "item_priority",
+    "item_category",
+    "needed_label",
+    "packed",
+]
+
+EXPORT_BATCH_SIZE = 5000
+
+
+def iter_history_rows(db: Session, user_id: int = None, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Yield lists of up to `batch_size` export rows (tuples in EXPORT_COLUMNS order).
+    Rows come from a streaming cursor, so memory use does not grow with history size.
+    """
+    stmt = (
+        select(
+            models.User.email,
+            models.DayContext.date,
+            models.DayContext.weekday,
+            models.DayContext.is_holiday,
+            models.DayContext.has_work_event,
+            models.DayContext.has_gym_event,
+            models.Item.name,
+            models.Item.priority,
+            models.Item.category,
+            models.DailyItemStatus.needed_label,
+            models.DailyItemStatus.packed,
+        )
+        .join(models.DayContext, models.DayContext.id == models.DailyItemStatus.context_id)
+        .join(models.Item, models.Item.id == models.DailyItemStatus.item_id)
+        .join(models.User, models.User.id == models.DailyItemStatus.user_id)
+        .where(models.DailyItemStatus.needed_label.isnot(None))
+        .order_by(models.User.id, models.DayContext.date, models.Item.id)
+    )
+    if user_id is not None:
+        stmt = stmt.where(models.DailyItemStatus.user_id == user_id)
+
+    result = db.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+    for partition in result.partitions():
+        yield [
+            (
+                email,
+                date.isoformat(),
+                weekday,
+                int(bool(is_holiday)),
+                int(bool(has_work_event)),
+                int(bool(has_gym_event)),
+                name,
+                priority or "medium",
+                category or "general",
+                int(bool(needed_label)),
+                int(bool(packed)),
+            )
+            for (email, date, weekday, is_holiday, has_work_event, has_gym_event,
+                 name, priority, category, needed_label, packed) in partition
+        ]
+
+
+def iter_csv(batches):
+    """Encode row batches as CSV text chunks (header first)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue()
+
+
+class _ChunkSink:
+    """Minimal writable file that hands back what was written since the last take()."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        out = b"".join(self.chunks)
+        self.chunks = []
+        return out
+
+
+def iter_parquet(batches):
+    """
+    Encode row batches as a Parquet file, one row group per batch,
+    yielding bytes as each row group is written. Needs pyarrow.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)") from e
+
+    schema = pa.schema([
+        ("user_email", pa.string()),
+        ("date", pa.string()),
+        ("weekday", pa.int8()),
+        ("is_holiday", pa.int8()),
+        ("has_work_event", pa.int8()),
+        ("has_gym_event", pa.int8()),
+        ("item_name", pa.string()),
+        ("item_priority", pa.string()),
+        ("item_category", pa.string()),
+        ("needed_label", pa.int8()),
+        ("packed", pa.int8()),
+    ])
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in batches:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                schema=schema,
+            ))
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export packing history as CSV or Parquet.")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--user", help="email of a single user (default: all users)")
+    parser.add_argument("--out", help="output file (default: stdout for CSV)")
+    args = parser.parse_args()
+
+    if args.format == "parquet" and not args.out:
+        parser.error("--out is required for Parquet output")
+
+    db = SessionLocal()
+    try:
+        user_id = None
+        if args.user:
+            user = db.query(models.User).filter(models.User.email == args.user.strip().lower()).first()
+            if not user:
+                parser.error(f"No user with email {args.user}")
+            user_id = user.id
+
+        batches = iter_history_rows(db, user_id)
+        if args.format == "csv":
+            out = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+            try:
+                for chunk in iter_csv(batches):
+                    out.write(chunk)
+            finally:
+                if args.out:
+                    out.close()
+        else:
+            with open(args.out, "wb") as out:
+                for chunk in iter_parquet(batches):
+                    out.write(chunk)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
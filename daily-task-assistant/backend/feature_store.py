@@ -0,0 +1,90 @@
+from sqlalchemy import case, delete, insert, select
+from sqlalchemy.orm import Session
+
+import models
+from online_counts import apply_count_changes, rebuild_online_counts, snapshot_counts
+
+"""
+Maintenance of the training_features table (see models.TrainingFeature).
+
+Call refresh_features() inside the same transaction as any write to
+DailyItemStatus rows, before commit, with criteria selecting the touched
+statuses (e.g. the context that was updated). The online outcome counts
+(online_counts.py) are derived from this table and adjusted here too.
+"""
+
+
+def _flag(column):
+    return case((column == True, 1), else_=0)
+
+
+def _feature_rows(*status_criteria):
+    """SELECT producing training_features rows for the matching labelled statuses."""
+    return (
+        select(
+            models.DailyItemStatus.id,
+            models.DailyItemStatus.user_id,
+            models.DailyItemStatus.item_id,
+            models.DailyItemStatus.context_id,
+            models.DayContext.date,
+            models.DayContext.weekday,
+            _flag(models.DayContext.is_holiday),
+            _flag(models.DayContext.has_work_event),
+            _flag(models.DayContext.has_gym_event),
+            case(models.PRIORITY_CODES, value=models.Item.priority,
+                 else_=models.DEFAULT_PRIORITY_CODE),
+            _flag(models.DailyItemStatus.needed_label),
+            _flag(models.DailyItemStatus.packed),
+        )
+        .join(models.DayContext, models.DayContext.id == models.DailyItemStatus.context_id)
+        .join(models.Item, models.Item.id == models.DailyItemStatus.item_id)
+        .where(models.DailyItemStatus.needed_label.isnot(None), *status_criteria)
+    )
+
+
+_FEATURE_COLUMNS = [
+    "status_id", "user_id", "item_id", "context_id", "date", "weekday",
+    "is_holiday", "has_work_event", "has_gym_event", "priority_code",
+    "needed_label", "packed",
+]
+
+
+def refresh_features(db: Session, *status_criteria):
+    """
+    Re-derive the feature rows of the DailyItemStatus rows matching
+    `status_criteria` (two statements) and apply the resulting change
+    to the online outcome counts. Does not commit.
+    """
+    db.flush()
+    touched = select(models.DailyItemStatus.id).where(*status_criteria)
+    before = snapshot_counts(db, models.TrainingFeature.status_id.in_(touched))
+    db.execute(
+        delete(models.TrainingFeature)
+        .where(models.TrainingFeature.status_id.in_(touched))
+    )
+    db.execute(
+        insert(models.TrainingFeature)
+        .from_select(_FEATURE_COLUMNS, _feature_rows(*status_criteria))
+    )
+    after = snapshot_counts(db, models.TrainingFeature.status_id.in_(touched))
+    apply_count_changes(db, before, after)
+
+
+def rebuild_feature_store(db: Session):
+    """Rebuild the whole table (and the counts derived from it) and commit."""
+    db.execute(delete(models.TrainingFeature))
+    db.execute(insert(models.TrainingFeature).from_select(_FEATURE_COLUMNS, _feature_rows()))
+    rebuild_online_counts(db)
+    db.commit()
+
+
+def ensure_feature_store(db: Session):
+    """Backfill the table once for databases created before it existed."""
+    has_features = db.query(models.TrainingFeature.status_id).first() is not None
+    has_labels = (
+        db.query(models.DailyItemStatus.id)
+        .filter(models.DailyItemStatus.needed_label.isnot(None))
+        .first()
+    ) is not None
+    if has_labels and not has_features:
+        rebuild_feature_store(db)
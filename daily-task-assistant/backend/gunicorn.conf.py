@@ -0,0 +1,46 @@
+import gc
+import os
+
+"""
+gunicorn settings for running several worker processes.
+
+Run from backend folder:
+
+    pip install gunicorn
+    MODEL_WARMUP=1 gunicorn
+
+The app is loaded once in the master (preload_app). With MODEL_WARMUP=1
+the master also loads the global model and the most active users'
+models (ml.warm_model_cache). Then gc.freeze() moves everything loaded
+so far out of the collector's reach, so garbage collections in the
+workers don't write to those pages. Forked workers share them
+copy-on-write and are warm from their first request. Each worker starts
+its own scheduler; the scheduler lease keeps the jobs on one of them.
+"""
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", "16"))
+# Thread budget per worker: each open /api/events stream holds a thread
+# for up to EVENTS_MAX_SECONDS, so at most EVENTS_MAX_STREAMS (default:
+# half of the threads) are streams and the rest stay free for ordinary
+# requests. Further streams are asked to reconnect later. To serve more
+# dashboards at once, raise WEB_THREADS (or WEB_CONCURRENCY).
+os.environ.setdefault("EVENTS_MAX_STREAMS", str(max(1, threads // 2)))
+preload_app = True
+# the scheduler's threads would not survive the fork: start it per worker
+wsgi_app = "app:create_app(start_scheduler=False)"
+
+
+def on_starting(server):
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # connections opened in the master must not be shared with the workers
+    from database import engine
+    engine.dispose(close=False)
+
+    import app
+    app.start_background_jobs()
@@ -0,0 +1,57 @@
+import datetime as dt
+import os
+import socket
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+
+
+def instance_id() -> str:
+    """
+    Identity of this process. Computed on each call so forked
+    workers (e.g. gunicorn) do not share their parent's id.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def try_acquire_lease(db: Session, name: str, owner: str, ttl_seconds: int) -> bool:
+    """
+    Acquire or renew the lease `name` for `owner`.
+    Succeeds if the lease is free, expired, or already held by `owner`.
+    """
+    now = dt.datetime.utcnow()
+    expires_at = now + dt.timedelta(seconds=ttl_seconds)
+
+    updated = (
+        db.query(models.SchedulerLease)
+        .filter(models.SchedulerLease.name == name,
+                or_(models.SchedulerLease.owner == owner,
+                    models.SchedulerLease.expires_at < now))
+        .update({"owner": owner, "expires_at": expires_at}, synchronize_session=False)
+    )
+    if updated:
+        db.commit()
+        return True
+
+    db.add(models.SchedulerLease(name=name, owner=owner, expires_at=expires_at))
+    try:
+        db.commit()
+        return True
+    except IntegrityError:
+        # Someone else holds a live lease
+        db.rollback()
+        return False
+
+
+def release_lease(db: Session, name: str, owner: str):
+    """Give up the lease early (e.g. on shutdown) so another process can take over."""
+    (
+        db.query(models.SchedulerLease)
+        .filter(models.SchedulerLease.name == name,
+                models.SchedulerLease.owner == owner)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
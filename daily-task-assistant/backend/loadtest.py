@@ -0,0 +1,107 @@
+import argparse
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+"""
+Tiny concurrent load generator for comparing serving modes.
+
+Start the app in one mode, then run e.g.:
+
+    python app.py                     # WSGI (Flask server)
+    uvicorn asgi:app --port 5000      # ASGI
+
+    python loadtest.py --path /api/predict_today --concurrency 32 --requests 1000
+
+Every client logs in once and then sends requests back to back.
+The script prints throughput and latency percentiles.
+"""
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def login(base_url: str, email: str, password: str) -> str:
+    """Log in through the form and return the session cookie header."""
+    opener = urllib.request.build_opener(_NoRedirect)
+    data = urllib.parse.urlencode({"email": email, "password": password}).encode()
+    try:
+        resp = opener.open(f"{base_url}/login", data=data)
+    except urllib.error.HTTPError as e:  # the 302 after a successful login
+        resp = e
+    cookies = resp.headers.get_all("Set-Cookie") or []
+    session = [c.split(";", 1)[0] for c in cookies if c.startswith("session=")]
+    if not session:
+        raise SystemExit("Login failed: no session cookie returned")
+    return session[0]
+
+
+def run(base_url: str, path: str, cookie: str, concurrency: int, total: int):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [total]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            req = urllib.request.Request(f"{base_url}{path}", headers={"Cookie": cookie})
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=60) as resp:
+                    resp.read()
+                ok = True
+            except Exception as e:
+                ok = False
+                with lock:
+                    errors.append(str(e))
+            elapsed = time.perf_counter() - t0
+            if ok:
+                with lock:
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    return latencies, errors, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare serving modes under concurrent load.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--path", default="/api/predict_today")
+    parser.add_argument("--email", default="demo1@example.com")
+    parser.add_argument("--password", default="demo123")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    cookie = login(args.url, args.email, args.password)
+    latencies, errors, wall = run(args.url, args.path, cookie, args.concurrency, args.requests)
+
+    if not latencies:
+        raise SystemExit(f"All requests failed, e.g. {errors[:1]}")
+    latencies.sort()
+    pct = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000
+    print(f"{args.path}  concurrency={args.concurrency}  requests={args.requests}")
+    print(f"  throughput: {len(latencies) / wall:.1f} req/s  errors: {len(errors)}")
+    print(
+        f"  latency ms: mean {statistics.mean(latencies) * 1000:.1f}  "
+        f"p50 {pct(0.50):.1f}  p95 {pct(0.95):.1f}  p99 {pct(0.99):.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
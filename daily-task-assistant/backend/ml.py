@@ -1,104 +1,315 @@
+import datetime as dt
+import functools
 import os
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
 from pathlib import Path
 from typing import List, Dict
 import json
 
+import numpy as np
 import pandas as pd
+from sqlalchemy import and_, case, func, literal, select
 from sqlalchemy.orm import Session
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.cluster import KMeans
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
 import joblib
 
 import models
+from database import SessionLocal
+from online_counts import context_bucket, predict_from_counts
+
+# scikit-learn is imported inside the training functions: serving only
+# unpickles fitted models, so it never loads the training-side modules.
 
 MODEL_DIR = Path(__file__).parent / "models_store"
 os.makedirs(MODEL_DIR, exist_ok=True)
 
+# "forest": a full RandomForest + LogisticRegression per user.
+# "residual": per-user logit offsets on top of the global model.
+PERSONAL_MODEL_MODE = os.environ.get("PERSONAL_MODEL_MODE", "forest")
+# Pseudo-count pulling residual offsets towards the global model
+RESIDUAL_PRIOR_STRENGTH = float(os.environ.get("RESIDUAL_PRIOR_STRENGTH", "10"))
+# "model": trained models (personal → global → heuristic).
+# "counts": online smoothed outcome counts (see online_counts.py).
+PREDICTOR = os.environ.get("PREDICTOR", "model")
+# Share of the most recent days held out when scoring a trained model
+HOLDOUT_FRACTION = float(os.environ.get("HOLDOUT_FRACTION", "0.2"))
+# Global training on a stratified sample of at most this many rows
+# (0 = use all labelled rows).
+GLOBAL_SAMPLE_SIZE = int(os.environ.get("GLOBAL_SAMPLE_SIZE", "0"))
+SAMPLE_STREAM_BATCH = 5_000
+
 
 # ---------- DATA LOADING ---------- #
 
-def load_training_data(db: Session, user_id: int) -> pd.DataFrame:
-    """
-    Load labelled training data for a single user.
-    """
-    q = (
-        db.query(models.DayContext, models.DailyItemStatus, models.Item)
-        .join(models.DailyItemStatus, models.DayContext.id == models.DailyItemStatus.context_id)
-        .join(models.Item, models.Item.id == models.DailyItemStatus.item_id)
-        .filter(models.DayContext.user_id == user_id)
+FEATURE_COLUMNS = ["weekday", "is_holiday", "has_work_event", "has_gym_event", "priority"]
+ITEM_COLUMNS = ["item_bucket", "category_code"]
+
+# Item identity is hashed into a fixed number of buckets, so new items
+# and renames never change the feature layout. The buckets are sparse
+# enough that distinct names rarely share one (must stay below 2**15:
+# the codes are stored as int16).
+ITEM_HASH_BUCKETS = int(os.environ.get("ITEM_HASH_BUCKETS", "4096"))
+CATEGORY_HASH_BUCKETS = int(os.environ.get("CATEGORY_HASH_BUCKETS", "4096"))
+
+
+def _hash_code(text, buckets: int) -> int:
+    return zlib.crc32((text or "").strip().lower().encode("utf-8")) % buckets
+
+
+def item_codes(name: str, category: str):
+    """(item_bucket, category_code) for an item."""
+    return (
+        _hash_code(name, ITEM_HASH_BUCKETS),
+        _hash_code(category or "general", CATEGORY_HASH_BUCKETS),
     )
 
-    rows = []
-    for ctx, status, item in q:
-        if status.needed_label is None:
-            continue
-        rows.append(
-            {
-                "weekday": ctx.weekday,
-                "is_holiday": int(ctx.is_holiday),
-                "has_work_event": int(ctx.has_work_event),
-                "has_gym_event": int(ctx.has_gym_event),
-                "priority": {"low": 0, "medium": 1, "high": 2}.get(item.priority, 1),
-                "needed_label": int(status.needed_label),
-                "packed": int(status.packed),
-            }
-        )
 
+def _feature_query(*criteria):
+    return select(
+        models.TrainingFeature.weekday,
+        models.TrainingFeature.is_holiday,
+        models.TrainingFeature.has_work_event,
+        models.TrainingFeature.has_gym_event,
+        models.TrainingFeature.priority_code.label("priority"),
+        models.TrainingFeature.needed_label,
+        models.TrainingFeature.packed,
+        models.TrainingFeature.item_id,
+        models.TrainingFeature.date,
+    ).where(*criteria)
+
+
+def _read_features(db: Session, stmt) -> pd.DataFrame:
+    rows = db.execute(stmt).all()
     if not rows:
         return pd.DataFrame()
-    return pd.DataFrame(rows)
+    small = FEATURE_COLUMNS + ["needed_label", "packed"]
+    df = pd.DataFrame(rows, columns=small + ["item_id", "date"])
+    df = df.astype({c: "int8" for c in small})
+    df["date"] = pd.to_datetime(df["date"])
+    return _with_item_codes(db, df)
+
+
+def _with_item_codes(db: Session, df: pd.DataFrame) -> pd.DataFrame:
+    """Hash each distinct item once, then map the codes onto the rows."""
+    items = db.execute(
+        select(models.Item.id, models.Item.name, models.Item.category)
+        .where(models.Item.id.in_(df["item_id"].unique().tolist()))
+    ).all()
+    codes = pd.DataFrame(
+        [(item_id, *item_codes(name, category)) for item_id, name, category in items],
+        columns=["item_id"] + ITEM_COLUMNS,
+    ).astype({c: "int16" for c in ITEM_COLUMNS})
+    return df.merge(codes, on="item_id", how="left")
+
+
+def _holdout_start(db: Session, *criteria):
+    """First day of the most recent HOLDOUT_FRACTION of days, or None if history is too short."""
+    days = db.execute(
+        select(models.TrainingFeature.date).where(*criteria).distinct().order_by(models.TrainingFeature.date)
+    ).scalars().all()
+    if len(days) < 5:
+        return None
+    return days[int(len(days) * (1 - HOLDOUT_FRACTION))]
+
+
+def load_training_counts(db: Session, *criteria) -> pd.DataFrame:
+    """
+    Labelled training data collapsed to one row per distinct
+    (features, item, recent) combination, with counts:
 
+        n         rows with these features
+        n_needed  rows where the item was needed
+        n_forgot  rows where it was needed but not packed
 
-def load_training_data_all_users(db: Session) -> pd.DataFrame:
+    `recent` marks rows from the holdout days (see HOLDOUT_FRACTION).
+    The grouping happens in SQL, so the frame's size depends on the
+    number of distinct combinations, not on the length of the history.
     """
-    Load labelled training data across ALL users.
-    This will be used to train a GLOBAL model that powers new users.
+    tf = models.TrainingFeature
+    start = _holdout_start(db, *criteria)
+    recent = case((tf.date >= start, 1), else_=0) if start is not None else literal(0)
+    keys = [
+        tf.weekday,
+        tf.is_holiday,
+        tf.has_work_event,
+        tf.has_gym_event,
+        tf.priority_code.label("priority"),
+        tf.item_id,
+        recent.label("recent"),
+    ]
+    rows = db.execute(
+        select(
+            *keys,
+            func.count().label("n"),
+            func.sum(tf.needed_label).label("n_needed"),
+            func.sum(case((and_(tf.needed_label == 1, tf.packed == 0), 1), else_=0)).label("n_forgot"),
+        )
+        .where(*criteria)
+        .group_by(*keys)
+    ).all()
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(rows, columns=FEATURE_COLUMNS + ["item_id", "recent", "n", "n_needed", "n_forgot"])
+    df = df.astype({c: "int8" for c in FEATURE_COLUMNS + ["recent"]})
+    return _with_item_codes(db, df)
+
+
+def _has_both_labels(counts: pd.DataFrame) -> bool:
+    return 0 < counts["n_needed"].sum() < counts["n"].sum()
+
+
+def weighted_rows(counts: pd.DataFrame, positive: str):
+    """
+    Expand counts into (X, y, sample_weight, recent): one positive and
+    one negative row per distinct feature vector, weighted by how often
+    each label occurred. Fitting on these approximates fitting on the
+    original duplicated rows: the forest's bootstrap and min_samples_*
+    count rows, not weights.
     """
-    q = (
-        db.query(models.DayContext, models.DailyItemStatus, models.Item)
-        .join(models.DailyItemStatus, models.DayContext.id == models.DailyItemStatus.context_id)
-        .join(models.Item, models.Item.id == models.DailyItemStatus.item_id)
+    grouped = counts.groupby(MODEL_COLUMNS + ["recent"], as_index=False)[["n", positive]].sum()
+    rows = pd.concat([
+        grouped.assign(label=1, weight=grouped[positive]),
+        grouped.assign(label=0, weight=grouped["n"] - grouped[positive]),
+    ], ignore_index=True)
+    rows = rows[rows["weight"] > 0]
+    return (
+        rows[MODEL_COLUMNS],
+        rows["label"].to_numpy(),
+        rows["weight"].to_numpy(dtype=float),
+        rows["recent"].to_numpy(dtype=bool),
     )
 
-    rows = []
-    for ctx, status, item in q:
-        if status.needed_label is None:
-            continue
-        rows.append(
-            {
-                "weekday": ctx.weekday,
-                "is_holiday": int(ctx.is_holiday),
-                "has_work_event": int(ctx.has_work_event),
-                "has_gym_event": int(ctx.has_gym_event),
-                "priority": {"low": 0, "medium": 1, "high": 2}.get(item.priority, 1),
-                "needed_label": int(status.needed_label),
-                "packed": int(status.packed),
-            }
-        )
 
-    if not rows:
-        return pd.DataFrame()
-    return pd.DataFrame(rows)
+def load_training_sample(db: Session, size: int, *criteria, seed: int = 42) -> pd.DataFrame:
+    """
+    Stratified reservoir sample of at most `size` labelled rows, in the
+    same layout as load_training_counts (one row per sampled row).
+
+    Rows are streamed from the DB in batches; each (user, needed_label)
+    stratum keeps an equal-size reservoir (Algorithm R), so small users
+    and the rarer label are not drowned out. Once there are more strata
+    than `size` rows, the strata coarsen to needed_label alone (then to a
+    single one), so neither the sample nor the per-stratum bookkeeping
+    grows with the number of users. Each sampled row is weighted by
+    stratum rows / sampled rows, so the weighted sample keeps the true
+    proportions.
+    """
+    tf = models.TrainingFeature
+    size = max(1, size)
+    levels = (
+        (lambda row: (row.user_id, row.needed_label), (tf.user_id, tf.needed_label)),
+        (lambda row: row.needed_label, (tf.needed_label,)),
+        (lambda row: None, ()),
+    )
+    for stratum_of, columns in levels:
+        if not columns:
+            n_strata = 1
+            break
+        n_strata = db.execute(
+            select(func.count()).select_from(select(*columns).where(*criteria).distinct().subquery())
+        ).scalar()
+        if not n_strata:
+            return pd.DataFrame()
+        if n_strata <= size:
+            break
+    capacity = size // n_strata
+    start = _holdout_start(db, *criteria)
+
+    rng = random.Random(seed)
+    reservoirs, seen = {}, {}
+    stmt = _feature_query(*criteria).add_columns(tf.user_id)
+    result = db.execute(stmt.execution_options(stream_results=True, yield_per=SAMPLE_STREAM_BATCH))
+    for partition in result.partitions():
+        for row in partition:
+            key = stratum_of(row)
+            reservoir = reservoirs.setdefault(key, [])
+            seen[key] = seen.get(key, 0) + 1
+            if len(reservoir) < capacity:
+                reservoir.append(row)
+            else:
+                j = rng.randrange(seen[key])
+                if j < capacity:
+                    reservoir[j] = row
+
+    records = []
+    for key, reservoir in reservoirs.items():
+        weight = seen[key] / len(reservoir)
+        for row in reservoir:
+            forgot = row.needed_label == 1 and row.packed == 0
+            records.append((
+                row.weekday, row.is_holiday, row.has_work_event, row.has_gym_event, row.priority,
+                row.item_id, int(start is not None and row.date >= start),
+                weight, weight * row.needed_label, weight * forgot,
+            ))
+    df = pd.DataFrame(records, columns=FEATURE_COLUMNS + ["item_id", "recent", "n", "n_needed", "n_forgot"])
+    df = df.astype({c: "int8" for c in FEATURE_COLUMNS + ["recent"]})
+    return _with_item_codes(db, df)
+
+
+def load_training_data(db: Session, user_id: int) -> pd.DataFrame:
+    """
+    Load labelled training data for a single user (from the feature table).
+    """
+    return _read_features(db, _feature_query(models.TrainingFeature.user_id == user_id))
+
+
+def load_training_data_all_users(db: Session) -> pd.DataFrame:
+    """
+    Load labelled training data across ALL users.
+    This will be used to train a GLOBAL model that powers new users.
+    """
+    return _read_features(db, _feature_query())
 
 
 # ---------- METRICS STORAGE ---------- #
 
-def _save_metrics(metrics_path: Path, y_true, y_pred):
+def _save_metrics(metrics_path: Path, y_true, y_pred, n_samples: int, evaluation: str = "holdout",
+                  sample_weight=None):
+    """
+    `evaluation` says what the scores were computed on: "holdout" (the most
+    recent days, not used for fitting) or "training" (too little history
+    to hold any out). `n_samples` is the number of rows the model uses.
+    """
+    from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+
     if len(y_true) == 0:
         return
+    w = sample_weight
     metrics = {
-        "accuracy": float(accuracy_score(y_true, y_pred)),
-        "precision": float(precision_score(y_true, y_pred, zero_division=0)),
-        "recall": float(recall_score(y_true, y_pred, zero_division=0)),
-        "f1": float(f1_score(y_true, y_pred, zero_division=0)),
-        "n_samples": int(len(y_true)),
+        "accuracy": float(accuracy_score(y_true, y_pred, sample_weight=w)),
+        "precision": float(precision_score(y_true, y_pred, sample_weight=w, zero_division=0)),
+        "recall": float(recall_score(y_true, y_pred, sample_weight=w, zero_division=0)),
+        "f1": float(f1_score(y_true, y_pred, sample_weight=w, zero_division=0)),
+        "n_samples": int(round(n_samples)),
+        "n_eval": int(len(y_true) if w is None else w.sum()),
+        "evaluation": evaluation,
     }
     with metrics_path.open("w", encoding="utf-8") as f:
         json.dump(metrics, f, indent=2)
 
 
+def _can_hold_out(test: np.ndarray, y) -> bool:
+    """True if there are recent rows to score on and older rows with both labels to fit on."""
+    return test.any() and not test.all() and len(np.unique(y[~test])) == 2
+
+
+def _save_model_metrics(metrics_path: Path, fit_model, X: pd.DataFrame, y, w, test, model):
+    """
+    Score a freshly trained model honestly: refit the same configuration
+    (`fit_model(X, y, sample_weight)`) on the older days and evaluate it
+    on the held-out recent ones.
+    """
+    n_samples = w.sum()
+    if not _can_hold_out(test, y):
+        _save_metrics(metrics_path, y, model.predict(X), n_samples, evaluation="training", sample_weight=w)
+        return
+    scored = fit_model(X[~test], y[~test], w[~test])
+    _save_metrics(metrics_path, y[test], scored.predict(X[test]), n_samples, sample_weight=w[test])
+
+
 def load_model_metrics(user_id: int) -> Dict:
     """
     Load stored PERSONAL model metrics for a user.
@@ -121,49 +332,342 @@ def load_global_model_metrics() -> Dict:
         return json.load(f)
 
 
+# ---------- DAY-TYPE CLUSTERS ---------- #
+
+DAY_COLUMNS = ["weekday", "is_holiday", "has_work_event", "has_gym_event"]
+MODEL_COLUMNS = FEATURE_COLUMNS + ITEM_COLUMNS + ["cluster_label"]
+# hash codes have no order, so the linear forget model leaves them out
+FORGET_COLUMNS = FEATURE_COLUMNS + ["cluster_label"]
+MAX_DAY_CLUSTERS = 3
+# Refit the clusters when contexts sit this much further from their
+# centroids (on average) than when the clusters were fitted.
+CLUSTER_DRIFT_RATIO = float(os.environ.get("CLUSTER_DRIFT_RATIO", "1.5"))
+CLUSTER_MIN_DISTANCE = 0.5
+
+
+def assign_day_clusters(centroids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """Nearest-centroid cluster label for each row of `vectors`."""
+    dists = ((vectors[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+    return dists.argmin(axis=1)
+
+
+def _nearest_distances(centroids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    dists = ((vectors[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+    return np.sqrt(dists.min(axis=1))
+
+
+def _fit_day_clusters(vectors: np.ndarray) -> Dict:
+    n_clusters = min(MAX_DAY_CLUSTERS, len(vectors))
+    if n_clusters < 2:
+        centroids = vectors.mean(axis=0, keepdims=True)
+    else:
+        from sklearn.cluster import KMeans
+
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+        kmeans.fit(vectors)
+        centroids = kmeans.cluster_centers_
+    return {
+        "centroids": centroids,
+        "n_clusters": len(centroids),
+        "mean_distance": float(_nearest_distances(centroids, vectors).mean()),
+    }
+
+
+def _cluster_file(cluster_path: Path, legacy_ctx_path: Path) -> Path:
+    """Stored centroids, or the `ctx_features` table older models were saved with."""
+    if cluster_path.exists() or not legacy_ctx_path.exists():
+        return cluster_path
+    return legacy_ctx_path
+
+
+def _load_day_clusters(path: Path):
+    """
+    Load fitted centroids. Older models only stored the `ctx_features`
+    table (distinct contexts + KMeans label); since KMeans centroids are
+    the means of their members, they are recovered exactly from it.
+    """
+    if not path.exists():
+        return None
+    stored = joblib.load(path)
+    if isinstance(stored, pd.DataFrame):
+        centroids = stored.groupby("cluster_label")[DAY_COLUMNS].mean().sort_index()
+        return {"centroids": centroids.to_numpy(dtype=float), "n_clusters": len(centroids),
+                "mean_distance": None}
+    return stored
+
+
+def _has_drifted(clusters: Dict, vectors: np.ndarray) -> bool:
+    if clusters.get("mean_distance") is None:
+        return True
+    if min(MAX_DAY_CLUSTERS, len(vectors)) > clusters["n_clusters"]:
+        return True
+    baseline = max(clusters["mean_distance"], CLUSTER_MIN_DISTANCE)
+    return _nearest_distances(clusters["centroids"], vectors).mean() > CLUSTER_DRIFT_RATIO * baseline
+
+
+def day_clusters_for(df: pd.DataFrame, cluster_path: Path, legacy_ctx_path: Path) -> Dict:
+    """
+    Reuse the stored day-type clusters for this training set, refitting
+    KMeans only when there are none yet or the contexts have drifted.
+    """
+    vectors = df[DAY_COLUMNS].drop_duplicates().to_numpy(dtype=float)
+    clusters = _load_day_clusters(_cluster_file(cluster_path, legacy_ctx_path))
+    if clusters is None or _has_drifted(clusters, vectors):
+        clusters = _fit_day_clusters(vectors)
+        joblib.dump(clusters, cluster_path)
+    return clusters
+
+
+def _label_rows(df: pd.DataFrame, centroids: np.ndarray) -> np.ndarray:
+    """Cluster label per row, computed once per distinct context."""
+    uniq, inverse = np.unique(df[DAY_COLUMNS].to_numpy(dtype=float), axis=0, return_inverse=True)
+    return assign_day_clusters(centroids, uniq)[inverse.ravel()]
+
+
+def store_cluster_labels(db: Session, centroids: np.ndarray, *context_criteria):
+    """
+    Write DayContext.cluster_label for the matching contexts in bulk:
+    a single UPDATE mapping each distinct context vector to its label.
+    """
+    contexts = models.DayContext.__table__
+    day_columns = [contexts.c.weekday, contexts.c.is_holiday,
+                   contexts.c.has_work_event, contexts.c.has_gym_event]
+    vectors = db.execute(select(*day_columns).where(*context_criteria).distinct()).all()
+    if not vectors:
+        return
+
+    labels = assign_day_clusters(centroids, np.array(vectors, dtype=float))
+    label_for_vector = case(
+        *[
+            (and_(*[col == value for col, value in zip(day_columns, vector)]), int(label))
+            for vector, label in zip(vectors, labels)
+        ],
+        else_=contexts.c.cluster_label,
+    )
+    db.execute(contexts.update().where(*context_criteria).values(cluster_label=label_for_vector))
+    db.commit()
+
+
+def _personal_model_user_ids() -> List[int]:
+    return [
+        int(p.stem.rsplit("_", 1)[1])
+        for p in MODEL_DIR.glob("routine_model_user_*.pkl")
+    ]
+
+
+def residual_user_ids() -> List[int]:
+    """Users whose personal model is a residual over the global model."""
+    return [
+        int(p.stem.rsplit("_", 1)[1])
+        for p in MODEL_DIR.glob("residual_user_*.json")
+    ]
+
+
+# ---------- MODEL SIZING ---------- #
+
+# (labelled rows below, n_estimators, max_depth); larger data gets LARGE_FOREST
+FOREST_TIERS = [(1_000, 20, 8), (10_000, 50, 12), (100_000, 100, None)]
+LARGE_FOREST = (200, None)
+# Fits on at least this many labelled rows use all cores
+PARALLEL_MIN_SAMPLES = 10_000
+TRAIN_MAX_JOBS = int(os.environ.get("TRAIN_MAX_JOBS", str(os.cpu_count() or 1)))
+# Wall-clock budget per forest fit; trees are added in chunks until it runs out
+TRAIN_TIME_BUDGET_SECONDS = float(os.environ.get("TRAIN_TIME_BUDGET_SECONDS", "30"))
+
+
+def forest_params(n_samples: int, use_all_cores: bool = False) -> Dict:
+    """Forest size, depth and parallelism for a fit on `n_samples` labelled rows."""
+    n_estimators, max_depth = LARGE_FOREST
+    for limit, tier_estimators, tier_depth in FOREST_TIERS:
+        if n_samples < limit:
+            n_estimators, max_depth = tier_estimators, tier_depth
+            break
+    parallel = use_all_cores or n_samples >= PARALLEL_MIN_SAMPLES
+    return {
+        "n_estimators": n_estimators,
+        "max_depth": max_depth,
+        "n_jobs": TRAIN_MAX_JOBS if parallel else 1,
+    }
+
+
+def fit_forest(X, y, sample_weight, params: Dict, time_budget: float = TRAIN_TIME_BUDGET_SECONDS):
+    """
+    Fit a RandomForest grown in chunks (warm_start), stopping early when
+    the next chunk would overrun `time_budget` seconds. At least one
+    chunk is always fitted.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    target = params["n_estimators"]
+    step = max(params["n_jobs"], target // 5)
+    model = RandomForestClassifier(**dict(params, n_estimators=min(step, target)),
+                                   warm_start=True, random_state=42)
+    started = time.perf_counter()
+    model.fit(X, y, sample_weight=sample_weight)
+    while model.n_estimators < target:
+        elapsed = time.perf_counter() - started
+        grow_to = min(model.n_estimators + step, target)
+        if elapsed / model.n_estimators * grow_to > time_budget:
+            break
+        model.n_estimators = grow_to
+        model.fit(X, y, sample_weight=sample_weight)
+
+    # predictions are a handful of rows per request: threads would only add overhead
+    model.set_params(warm_start=False, n_jobs=1)
+    return model
+
+
 # ---------- TRAINING: PERSONAL MODEL ---------- #
 
 def train_models_for_user(db: Session, user_id: int) -> bool:
     """
     Train a personal model for a specific user.
+    In "residual" mode this only fits offsets over the global model
+    (falling back to a full model while no global model exists).
     """
-    df = load_training_data(db, user_id)
-    if df.empty or df["needed_label"].nunique() < 2:
-        return False
+    from sklearn.linear_model import LogisticRegression
 
-    # Cluster “day types”
-    day_features = df[["weekday", "is_holiday", "has_work_event", "has_gym_event"]].drop_duplicates()
-    n_clusters = min(3, len(day_features))
-    if n_clusters < 2:
-        day_features["cluster_label"] = 0
-    else:
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        kmeans.fit(day_features)
-        day_features["cluster_label"] = kmeans.labels_
+    counts = load_training_counts(db, models.TrainingFeature.user_id == user_id)
+    if counts.empty or not _has_both_labels(counts):
+        return False
 
-    df = df.merge(
-        day_features,
-        on=["weekday", "is_holiday", "has_work_event", "has_gym_event"],
-        how="left",
-    )
+    if PERSONAL_MODEL_MODE == "residual" and train_residual_for_user(user_id, counts):
+        return True
 
-    X = df[["weekday", "is_holiday", "has_work_event", "has_gym_event", "priority", "cluster_label"]]
-    y_needed = df["needed_label"]
-    y_forget = ((df["needed_label"] == 1) & (df["packed"] == 0)).astype(int)
+    # Cluster “day types” (reusing the stored centroids when still valid)
+    clusters = day_clusters_for(counts, *_personal_cluster_paths(user_id))
+    counts["cluster_label"] = _label_rows(counts, clusters["centroids"])
 
-    routine_model = RandomForestClassifier(n_estimators=100, random_state=42)
-    routine_model.fit(X, y_needed)
+    X, y_needed, w_needed, recent = weighted_rows(counts, "n_needed")
+    fit_routine_model = functools.partial(fit_forest, params=forest_params(int(w_needed.sum())))
+    routine_model = fit_routine_model(X, y_needed, w_needed)
 
-    y_pred = routine_model.predict(X)
-    _save_metrics(MODEL_DIR / f"metrics_user_{user_id}.json", y_needed, y_pred)
+    _save_model_metrics(MODEL_DIR / f"metrics_user_{user_id}.json", fit_routine_model,
+                        X, y_needed, w_needed, recent, routine_model)
 
+    X, y_forget, w_forget, _ = weighted_rows(counts, "n_forgot")
     forget_model = LogisticRegression(max_iter=1000)
-    forget_model.fit(X, y_forget)
+    forget_model.fit(X[FORGET_COLUMNS], y_forget, sample_weight=w_forget)
 
-    joblib.dump(day_features, MODEL_DIR / f"ctx_features_user_{user_id}.pkl")
     joblib.dump(routine_model, MODEL_DIR / f"routine_model_user_{user_id}.pkl")
     joblib.dump(forget_model, MODEL_DIR / f"forget_model_user_{user_id}.pkl")
 
+    _residual_path(user_id).unlink(missing_ok=True)
+
+    store_cluster_labels(db, clusters["centroids"], models.DayContext.user_id == user_id)
+
+    return True
+
+
+# ---------- TRAINING: PERSONAL RESIDUAL OVER GLOBAL ---------- #
+
+def _logit(p):
+    p = np.clip(p, 1e-4, 1 - 1e-4)
+    return np.log(p / (1 - p))
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+def _fit_offsets(keys, pos, n, base_logit) -> Dict[str, float]:
+    """
+    Logit offset per key: log-odds of the user's observed rate (`pos` of
+    `n` rows), smoothed towards the global model's mean probability with
+    RESIDUAL_PRIOR_STRENGTH pseudo-observations, minus the log-odds of
+    that mean.
+    """
+    frame = pd.DataFrame({"key": np.asarray(keys), "pos": np.asarray(pos), "n": np.asarray(n)})
+    frame["np"] = frame["n"] * _sigmoid(base_logit)
+    g = frame.groupby("key")[["n", "pos", "np"]].sum()
+    p = g["np"] / g["n"]
+    rate = (g["pos"] + RESIDUAL_PRIOR_STRENGTH * p) / (g["n"] + RESIDUAL_PRIOR_STRENGTH)
+    offsets = _logit(rate.to_numpy()) - _logit(p.to_numpy())
+    return {str(k): float(v) for k, v in zip(g.index, offsets)}
+
+
+def _lookup(offsets: Dict[str, float], keys) -> np.ndarray:
+    return np.array([offsets.get(str(k), 0.0) for k in keys])
+
+
+def _context_buckets(df: pd.DataFrame) -> np.ndarray:
+    """online_counts.context_bucket for every row."""
+    return (df["weekday"].to_numpy(dtype=int) * 8 + df["is_holiday"].to_numpy(dtype=int) * 4
+            + df["has_work_event"].to_numpy(dtype=int) * 2 + df["has_gym_event"].to_numpy(dtype=int))
+
+
+def _fit_residual(pos, n, probs, buckets, item_ids) -> Dict:
+    """
+    Day-type offsets first, then per-item offsets on what is left. Day
+    types are exact context buckets rather than the global model's
+    cluster labels, which are renumbered whenever KMeans is refitted.
+    """
+    base = _logit(probs)
+    by_context = _fit_offsets(buckets, pos, n, base)
+    by_item = _fit_offsets(item_ids, pos, n, base + _lookup(by_context, buckets))
+    return {"context": by_context, "item": by_item}
+
+
+def _apply_residual(probs, offsets: Dict, buckets, item_ids) -> np.ndarray:
+    # files written before the offsets were keyed by context bucket only
+    # have cluster offsets; those are skipped until the user is refitted
+    z = _logit(probs) + _lookup(offsets.get("context", {}), buckets) + _lookup(offsets["item"], item_ids)
+    return _sigmoid(z)
+
+
+def train_residual_for_user(user_id: int, counts: pd.DataFrame) -> bool:
+    """
+    Store a user's personal model as a few offsets over the global model
+    (a small JSON file instead of a forest). Returns False if there is no
+    global model to build on.
+    """
+    g_ctx_path, g_routine_path, g_forget_path = _global_model_paths()
+    if not (g_ctx_path.exists() and g_routine_path.exists() and g_forget_path.exists()):
+        return False
+
+    clusters = _load_day_clusters(g_ctx_path)
+    counts["cluster_label"] = _label_rows(counts, clusters["centroids"])
+    routine_model, forget_model = joblib.load(g_routine_path), joblib.load(g_forget_path)
+    need_probs = routine_model.predict_proba(counts[_input_columns(routine_model)])[:, 1]
+    forget_probs = forget_model.predict_proba(counts[_input_columns(forget_model)])[:, 1]
+
+    buckets, items, n = _context_buckets(counts), counts["item_id"], counts["n"]
+    residual = {
+        "need": _fit_residual(counts["n_needed"], n, need_probs, buckets, items),
+        "forget": _fit_residual(counts["n_forgot"], n, forget_probs, buckets, items),
+        "n_samples": int(n.sum()),
+    }
+
+    # score on the holdout days with offsets from the older days only
+    # (the global model itself has seen every day)
+    test = counts["recent"].to_numpy(dtype=bool)
+    evaluation = "holdout"
+    if not (test.any() and _has_both_labels(counts[~test])):
+        test[:] = True
+        evaluation = "training"
+        scored = residual["need"]
+    else:
+        train = ~test
+        scored = _fit_residual(counts["n_needed"][train], n[train], need_probs[train],
+                               buckets[train], items[train])
+    adjusted = _apply_residual(need_probs[test], scored, buckets[test], items[test]) >= 0.5
+    pos, neg = counts["n_needed"][test].to_numpy(), (n - counts["n_needed"])[test].to_numpy()
+    _save_metrics(
+        MODEL_DIR / f"metrics_user_{user_id}.json",
+        np.r_[np.ones(len(pos)), np.zeros(len(neg))],
+        np.r_[adjusted, adjusted].astype(int),
+        n.sum(),
+        evaluation=evaluation,
+        sample_weight=np.r_[pos, neg].astype(float),
+    )
+
+    with _residual_path(user_id).open("w", encoding="utf-8") as f:
+        json.dump(residual, f)
+
+    # the residual replaces any full personal model
+    for path in (*_personal_cluster_paths(user_id), *_personal_model_paths(user_id)[1:]):
+        path.unlink(missing_ok=True)
+
     return True
 
 
@@ -173,80 +677,85 @@ def train_global_models(db: Session) -> bool:
     """
     Train ONE global model across all users.
     New users (without personal model) will use this global model.
+    With GLOBAL_SAMPLE_SIZE set, it is fitted on a bounded stratified
+    sample instead of every labelled row.
     """
-    df = load_training_data_all_users(db)
-    if df.empty or df["needed_label"].nunique() < 2:
-        return False
+    from sklearn.linear_model import LogisticRegression
 
-    day_features = df[["weekday", "is_holiday", "has_work_event", "has_gym_event"]].drop_duplicates()
-    n_clusters = min(3, len(day_features))
-    if n_clusters < 2:
-        day_features["cluster_label"] = 0
+    if GLOBAL_SAMPLE_SIZE > 0:
+        counts = load_training_sample(db, GLOBAL_SAMPLE_SIZE)
     else:
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        kmeans.fit(day_features)
-        day_features["cluster_label"] = kmeans.labels_
-
-    df = df.merge(
-        day_features,
-        on=["weekday", "is_holiday", "has_work_event", "has_gym_event"],
-        how="left",
-    )
+        counts = load_training_counts(db)
+    if counts.empty or not _has_both_labels(counts):
+        return False
 
-    X = df[["weekday", "is_holiday", "has_work_event", "has_gym_event", "priority", "cluster_label"]]
-    y_needed = df["needed_label"]
-    y_forget = ((df["needed_label"] == 1) & (df["packed"] == 0)).astype(int)
+    clusters = day_clusters_for(counts, *_global_cluster_paths())
+    counts["cluster_label"] = _label_rows(counts, clusters["centroids"])
 
-    routine_model = RandomForestClassifier(n_estimators=120, random_state=42)
-    routine_model.fit(X, y_needed)
+    X, y_needed, w_needed, recent = weighted_rows(counts, "n_needed")
+    fit_routine_model = functools.partial(
+        fit_forest, params=forest_params(int(w_needed.sum()), use_all_cores=True)
+    )
+    routine_model = fit_routine_model(X, y_needed, w_needed)
 
-    y_pred = routine_model.predict(X)
-    _save_metrics(MODEL_DIR / "metrics_global.json", y_needed, y_pred)
+    _save_model_metrics(MODEL_DIR / "metrics_global.json", fit_routine_model,
+                        X, y_needed, w_needed, recent, routine_model)
 
+    X, y_forget, w_forget, _ = weighted_rows(counts, "n_forgot")
     forget_model = LogisticRegression(max_iter=1000)
-    forget_model.fit(X, y_forget)
+    forget_model.fit(X[FORGET_COLUMNS], y_forget, sample_weight=w_forget)
 
-    joblib.dump(day_features, MODEL_DIR / "global_ctx_features.pkl")
     joblib.dump(routine_model, MODEL_DIR / "global_routine_model.pkl")
     joblib.dump(forget_model, MODEL_DIR / "global_forget_model.pkl")
 
+    # users with a personal model keep their own cluster labels
+    store_cluster_labels(db, clusters["centroids"],
+                         models.DayContext.user_id.notin_(_personal_model_user_ids()))
+
     return True
 
 
 # ---------- PREDICTION (PERSONAL → GLOBAL → HEURISTIC) ---------- #
 
-def _predict_with_models(context_features: Dict, items: List[Dict], day_features, routine_model, forget_model):
+def _input_columns(model) -> List[str]:
     """
-    Shared logic: given context + items + loaded models, compute predictions.
+    The MODEL_COLUMNS this model was trained on. Models trained before
+    item features existed simply don't select them.
     """
-    ctx_df = pd.DataFrame([context_features])
-    merged = ctx_df.merge(
-        day_features,
-        on=["weekday", "is_holiday", "has_work_event", "has_gym_event"],
-        how="left",
-    )
-    if merged["cluster_label"].isna().all():
-        merged["cluster_label"] = 0
+    return list(getattr(model, "feature_names_in_", MODEL_COLUMNS))
 
-    cluster_label = int(merged["cluster_label"].iloc[0])
 
-    rows = []
-    for it in items:
-        rows.append(
-            {
-                "weekday": context_features["weekday"],
-                "is_holiday": context_features["is_holiday"],
-                "has_work_event": context_features["has_work_event"],
-                "has_gym_event": context_features["has_gym_event"],
-                "priority": {"low": 0, "medium": 1, "high": 2}.get(it["priority"], 1),
-                "cluster_label": cluster_label,
-            }
-        )
+def _model_input(model, matrix: np.ndarray) -> pd.DataFrame:
+    """Columns of the feature matrix (MODEL_COLUMNS order) this model was trained on."""
+    names = _input_columns(model)
+    return pd.DataFrame(matrix[:, [MODEL_COLUMNS.index(n) for n in names]], columns=names)
 
-    X = pd.DataFrame(rows)
-    need_probs = routine_model.predict_proba(X)[:, 1]
-    forget_probs = forget_model.predict_proba(X)[:, 1]
 
+def _model_probabilities(context_features: Dict, items: List[Dict], clusters, routine_model, forget_model):
+    """
+    Run the models for today's context and items.
+    Returns (cluster_label, need_probs, forget_probs).
+    """
+    day_vector = np.array([[context_features[c] for c in DAY_COLUMNS]], dtype=float)
+    cluster_label = int(assign_day_clusters(clusters["centroids"], day_vector)[0])
+    if not items:
+        return cluster_label, np.empty(0), np.empty(0)
+
+    # one feature matrix for all items, in MODEL_COLUMNS order
+    matrix = np.empty((len(items), len(MODEL_COLUMNS)), dtype=np.int16)
+    matrix[:, :len(DAY_COLUMNS)] = day_vector
+    matrix[:, len(DAY_COLUMNS)] = [
+        models.PRIORITY_CODES.get(it["priority"], models.DEFAULT_PRIORITY_CODE) for it in items
+    ]
+    matrix[:, len(FEATURE_COLUMNS):-1] = [item_codes(it["name"], it.get("category")) for it in items]
+    matrix[:, -1] = cluster_label
+
+    need_probs = routine_model.predict_proba(_model_input(routine_model, matrix))[:, 1]
+    forget_probs = forget_model.predict_proba(_model_input(forget_model, matrix))[:, 1]
+    return cluster_label, need_probs, forget_probs
+
+
+def _rank_predictions(items: List[Dict], need_probs, forget_probs):
     results = []
     for it, p_need, p_forget in zip(items, need_probs, forget_probs):
         score = float(p_need * (0.7 + 0.3 * p_forget))
@@ -264,35 +773,218 @@ def _predict_with_models(context_features: Dict, items: List[Dict], day_features
     return results
 
 
+def _predict_with_models(context_features: Dict, items: List[Dict], clusters, routine_model, forget_model):
+    """
+    Shared logic: given context + items + loaded models, compute predictions.
+    """
+    _, need_probs, forget_probs = _model_probabilities(
+        context_features, items, clusters, routine_model, forget_model
+    )
+    return _rank_predictions(items, need_probs, forget_probs)
+
+
+def _predict_with_residual(context_features: Dict, items: List[Dict], residual: Dict,
+                           clusters, routine_model, forget_model):
+    _, need_probs, forget_probs = _model_probabilities(
+        context_features, items, clusters, routine_model, forget_model
+    )
+    bucket = context_bucket(context_features["weekday"], context_features["is_holiday"],
+                            context_features["has_work_event"], context_features["has_gym_event"])
+    buckets = [bucket] * len(items)
+    item_ids = [it["id"] for it in items]
+    return _rank_predictions(
+        items,
+        _apply_residual(need_probs, residual["need"], buckets, item_ids),
+        _apply_residual(forget_probs, residual["forget"], buckets, item_ids),
+    )
+
+
+def _personal_cluster_paths(user_id: int):
+    return (
+        MODEL_DIR / f"day_clusters_user_{user_id}.pkl",
+        MODEL_DIR / f"ctx_features_user_{user_id}.pkl",
+    )
+
+
+def _global_cluster_paths():
+    return (
+        MODEL_DIR / "global_day_clusters.pkl",
+        MODEL_DIR / "global_ctx_features.pkl",
+    )
+
+
+def _personal_model_paths(user_id: int):
+    return (
+        _cluster_file(*_personal_cluster_paths(user_id)),
+        MODEL_DIR / f"routine_model_user_{user_id}.pkl",
+        MODEL_DIR / f"forget_model_user_{user_id}.pkl",
+    )
+
+
+def _global_model_paths():
+    return (
+        _cluster_file(*_global_cluster_paths()),
+        MODEL_DIR / "global_routine_model.pkl",
+        MODEL_DIR / "global_forget_model.pkl",
+    )
+
+
+def _residual_path(user_id: int) -> Path:
+    return MODEL_DIR / f"residual_user_{user_id}.json"
+
+
+# ---------- MODEL CACHE ---------- #
+
+# Fitted model files kept in memory, keyed by path and reloaded when the
+# file's mtime changes. Filled lazily, or up front by warm_model_cache().
+MODEL_CACHE_SIZE = int(os.environ.get("MODEL_CACHE_SIZE", "256"))
+# Users whose personal models are preloaded by warm_model_cache()
+MODEL_WARMUP_USERS = int(os.environ.get("MODEL_WARMUP_USERS", "50"))
+MODEL_WARMUP_DAYS = 14
+
+_model_cache = OrderedDict()  # path -> (mtime_ns, loaded object)
+_model_cache_lock = threading.Lock()
+_warmed_at = None
+
+
+def _read_json(path: Path):
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _cached_load(path: Path, loader=joblib.load):
+    """`loader(path)`, memoised until the file changes (LRU, MODEL_CACHE_SIZE entries)."""
+    mtime = path.stat().st_mtime_ns
+    with _model_cache_lock:
+        hit = _model_cache.get(path)
+        if hit is not None and hit[0] == mtime:
+            _model_cache.move_to_end(path)
+            return hit[1]
+
+    value = loader(path)
+    with _model_cache_lock:
+        _model_cache[path] = (mtime, value)
+        _model_cache.move_to_end(path)
+        while len(_model_cache) > MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+    return value
+
+
+def _load_model_set(paths):
+    """(clusters, routine_model, forget_model) for a _personal/_global_model_paths tuple."""
+    cluster_path, routine_path, forget_path = paths
+    return (
+        _cached_load(cluster_path, _load_day_clusters),
+        _cached_load(routine_path),
+        _cached_load(forget_path),
+    )
+
+
+def _most_active_users(db: Session, limit: int) -> List[int]:
+    tf = models.TrainingFeature
+    latest = db.execute(select(func.max(tf.date))).scalar()
+    if latest is None:
+        return []
+    since = latest - dt.timedelta(days=MODEL_WARMUP_DAYS)
+    return db.execute(
+        select(tf.user_id)
+        .where(tf.date >= since)
+        .group_by(tf.user_id)
+        .order_by(func.count().desc())
+        .limit(limit)
+    ).scalars().all()
+
+
+def warm_model_cache(db: Session, n_users: int = MODEL_WARMUP_USERS) -> int:
+    """
+    Load the global model and the personal models of the `n_users` users
+    with the most recent labels into the cache. Run in a preforking
+    server's master, the workers share these pages copy-on-write instead
+    of each unpickling them on first use. Returns the number of files cached.
+    """
+    global _warmed_at
+    paths = [_global_model_paths()]
+    for user_id in _most_active_users(db, n_users):
+        paths.append(_personal_model_paths(user_id))
+        residual_path = _residual_path(user_id)
+        if residual_path.exists():
+            _cached_load(residual_path, _read_json)
+
+    for model_paths in paths:
+        if all(p.exists() for p in model_paths):
+            _load_model_set(model_paths)
+    _warmed_at = dt.datetime.utcnow()
+    return len(_model_cache)
+
+
+def model_cache_status() -> Dict:
+    return {
+        "models": "warm" if _warmed_at is not None else "cold",
+        "cached_files": len(_model_cache),
+        "warmed_at": _warmed_at.isoformat() + "Z" if _warmed_at else None,
+    }
+
+
+def model_version(user_id: int) -> str:
+    """
+    Cheap identifier of the model set that would serve this user
+    (file modification times), used for caching / ETags.
+    Count-based predictions change with the user's own writes, which
+    already bump User.data_version, and with the pooled counts
+    (app.pooled_counts_version).
+    """
+    if PREDICTOR == "counts":
+        return "counts"
+    candidates = (
+        ("personal", _personal_model_paths(user_id)),
+        ("residual", (_residual_path(user_id), *_global_model_paths())),
+        ("global", _global_model_paths()),
+    )
+    for kind, paths in candidates:
+        if all(p.exists() for p in paths):
+            return kind + ":" + "-".join(str(p.stat().st_mtime_ns) for p in paths)
+    return "heuristic"
+
+
 def predict_items_for_today(user_id: int, context_features: Dict, items: List[Dict]):
     """
     Prediction logic with 3 levels:
 
-    1) If PERSONAL model exists for this user → use it.
+    1) If PERSONAL model exists for this user → use it
+       (a full model, or residual offsets applied to the global model).
     2) Else if GLOBAL model exists → use it.
     3) Else → use simple heuristic based on priority.
+
+    With PREDICTOR=counts, the online outcome counts are used instead.
     """
+    if PREDICTOR == "counts":
+        # own session: SessionLocal() would hand back (and then close) the caller's
+        db = SessionLocal.session_factory()
+        try:
+            need_probs, forget_probs = predict_from_counts(db, user_id, context_features, items)
+        finally:
+            db.close()
+        return _rank_predictions(items, need_probs, forget_probs)
+
     # --- Try personal model first ---
-    ctx_path = MODEL_DIR / f"ctx_features_user_{user_id}.pkl"
-    routine_path = MODEL_DIR / f"routine_model_user_{user_id}.pkl"
-    forget_path = MODEL_DIR / f"forget_model_user_{user_id}.pkl"
+    ctx_path, routine_path, forget_path = _personal_model_paths(user_id)
 
     if ctx_path.exists() and routine_path.exists() and forget_path.exists():
-        day_features = joblib.load(ctx_path)
-        routine_model = joblib.load(routine_path)
-        forget_model = joblib.load(forget_path)
-        return _predict_with_models(context_features, items, day_features, routine_model, forget_model)
+        clusters, routine_model, forget_model = _load_model_set((ctx_path, routine_path, forget_path))
+        return _predict_with_models(context_features, items, clusters, routine_model, forget_model)
 
     # --- Otherwise, try GLOBAL model ---
-    g_ctx_path = MODEL_DIR / "global_ctx_features.pkl"
-    g_routine_path = MODEL_DIR / "global_routine_model.pkl"
-    g_forget_path = MODEL_DIR / "global_forget_model.pkl"
+    g_ctx_path, g_routine_path, g_forget_path = _global_model_paths()
 
     if g_ctx_path.exists() and g_routine_path.exists() and g_forget_path.exists():
-        day_features = joblib.load(g_ctx_path)
-        routine_model = joblib.load(g_routine_path)
-        forget_model = joblib.load(g_forget_path)
-        return _predict_with_models(context_features, items, day_features, routine_model, forget_model)
+        clusters, routine_model, forget_model = _load_model_set((g_ctx_path, g_routine_path, g_forget_path))
+
+        residual_path = _residual_path(user_id)
+        if residual_path.exists():
+            residual = _cached_load(residual_path, _read_json)
+            return _predict_with_residual(context_features, items, residual,
+                                          clusters, routine_model, forget_model)
+        return _predict_with_models(context_features, items, clusters, routine_model, forget_model)
 
     # --- Fallback heuristic (if no models yet) ---
     results = []
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, Date, Time, ForeignKey
+from sqlalchemy import (
+    Column, Integer, SmallInteger, String, Text, Boolean, Date, Time, DateTime, ForeignKey, Index, UniqueConstraint
+)
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -9,6 +11,9 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
     password_hash = Column(String, nullable=False)
+    timezone = Column(String, nullable=True)       # IANA name, e.g. "Europe/Berlin"; None = server time
+    reminder_time = Column(Time, nullable=True)    # local time for the daily email; None = default
+    data_version = Column(Integer, default=0, server_default="0")  # bumped on every data change (ETags)
 
     items = relationship("Item", back_populates="user", cascade="all, delete-orphan")
     contexts = relationship("DayContext", back_populates="user", cascade="all, delete-orphan")
@@ -30,6 +35,8 @@ class Item(Base):
 
 class DayContext(Base):
     __tablename__ = "day_contexts"
+    # one context per user and day (replaces the non-unique ix_day_contexts_user_date)
+    __table_args__ = (Index("uq_day_contexts_user_date", "user_id", "date", unique=True),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -39,6 +46,8 @@ class DayContext(Base):
     has_work_event = Column(Boolean, default=False)
     has_gym_event = Column(Boolean, default=False)
     cluster_label = Column(Integer, nullable=True)
+    # bumped on every checklist write for this day (optimistic concurrency for delta sync)
+    checklist_version = Column(Integer, default=0, server_default="0")
 
     user = relationship("User", back_populates="contexts")
     item_statuses = relationship("DailyItemStatus", back_populates="context", cascade="all, delete-orphan")
@@ -46,6 +55,7 @@ class DayContext(Base):
 
 class DailyItemStatus(Base):
     __tablename__ = "daily_item_status"
+    __table_args__ = (Index("ix_daily_item_status_context", "context_id", "item_id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -58,4 +68,160 @@ class DailyItemStatus(Base):
     feedback = Column(String, nullable=True)
 
     item = relationship("Item", back_populates="statuses")
-    context = relationship("DayContext", back_populates="item_statuses")
\ No newline at end of file
+    context = relationship("DayContext", back_populates="item_statuses")
+
+
+class ReminderLog(Base):
+    """
+    Progress record for the daily reminder job: one row per user per day.
+    Lets a crashed or restarted run skip users who were already emailed.
+    """
+    __tablename__ = "reminder_logs"
+    __table_args__ = (UniqueConstraint("user_id", "date", name="uq_reminder_user_date"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    date = Column(Date, nullable=False)
+    status = Column(String, default="pending")  # pending/queued/failed (delivery: EmailOutbox.status)
+    attempts = Column(Integer, default=0)
+    error = Column(String, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+
+
+class SchedulerLease(Base):
+    """
+    DB-backed lease used for leader election between app processes.
+    Only the current holder of a lease runs the background jobs.
+    """
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class EmailOutbox(Base):
+    """
+    Rendered emails waiting for delivery. The reminder job renders into
+    this table; delivery workers drain it independently.
+    """
+    __tablename__ = "email_outbox"
+    __table_args__ = (UniqueConstraint("user_id", "date", "kind", name="uq_outbox_user_date_kind"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    date = Column(Date, nullable=False)
+    kind = Column(String, nullable=False, default="daily_reminder")
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    html_body = Column(Text, nullable=False)
+    status = Column(String, default="queued", index=True)  # queued/sending/sent/failed
+    attempts = Column(Integer, default=0)
+    claimed_by = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+    sent_at = Column(DateTime, nullable=True)
+
+
+# Integer codes for Item.priority, used as the ML "priority" feature
+PRIORITY_CODES = {"low": 0, "medium": 1, "high": 2}
+DEFAULT_PRIORITY_CODE = 1
+
+
+class TrainingFeature(Base):
+    """
+    Denormalized, compactly typed training row: one per labelled
+    DailyItemStatus, with its context flags and priority code inlined.
+    Kept up to date on status writes (see feature_store.py) so training
+    reads it with a single indexed scan instead of a three-way join.
+    """
+    __tablename__ = "training_features"
+    __table_args__ = (Index("ix_training_features_user_date", "user_id", "date"),)
+
+    status_id = Column(Integer, ForeignKey("daily_item_status.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
+    context_id = Column(Integer, ForeignKey("day_contexts.id"), nullable=False)
+    date = Column(Date, nullable=False)
+    weekday = Column(SmallInteger, nullable=False)
+    is_holiday = Column(SmallInteger, nullable=False)
+    has_work_event = Column(SmallInteger, nullable=False)
+    has_gym_event = Column(SmallInteger, nullable=False)
+    priority_code = Column(SmallInteger, nullable=False)
+    needed_label = Column(SmallInteger, nullable=False)
+    packed = Column(SmallInteger, nullable=False)
+
+
+class ItemOutcomeCount(Base):
+    """
+    Running label counts per (user, item, context bucket) for the online
+    count-based predictor. Updated incrementally on every status write
+    (see online_counts.py).
+    """
+    __tablename__ = "item_outcome_counts"
+    __table_args__ = (
+        UniqueConstraint("user_id", "item_id", "context_bucket", name="uq_item_outcome_counts"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
+    context_bucket = Column(SmallInteger, nullable=False)
+    n = Column(Integer, nullable=False, default=0)
+    n_needed = Column(Integer, nullable=False, default=0)
+    n_forgot = Column(Integer, nullable=False, default=0)
+
+
+class GlobalOutcomeCount(Base):
+    """Same counts pooled across users, keyed by normalized item name."""
+    __tablename__ = "global_outcome_counts"
+    __table_args__ = (
+        UniqueConstraint("item_name", "context_bucket", name="uq_global_outcome_counts"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    item_name = Column(String, nullable=False)
+    context_bucket = Column(SmallInteger, nullable=False)
+    n = Column(Integer, nullable=False, default=0)
+    n_needed = Column(Integer, nullable=False, default=0)
+    n_forgot = Column(Integer, nullable=False, default=0)
+    # stamped on every upsert; max() versions the pooled counts for ETags/snapshots
+    updated_at = Column(DateTime, nullable=True, index=True)
+
+
+class ModelTrainingState(Base):
+    """
+    Per-user bookkeeping for automatic personal retraining: when the
+    user's labels last changed, and how many labelled rows the current
+    model was fitted on (see retrain_queue.py).
+    """
+    __tablename__ = "model_training_state"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    labels_at_fit = Column(Integer, nullable=False, default=0)
+    last_change_at = Column(DateTime, nullable=True)
+    last_trained_at = Column(DateTime, nullable=True)
+    # set when the model must be refitted regardless of new labels
+    # (residual models after a global retrain); cleared by the next fit
+    refit_requested = Column(Boolean, default=False, server_default="0")
+
+
+class DailyPrediction(Base):
+    """
+    Snapshot of a user's ranked predictions for one day. Valid while the
+    serving model version and the context key (day context + item list)
+    match; otherwise it is recomputed and replaced.
+    """
+    __tablename__ = "daily_predictions"
+    __table_args__ = (
+        UniqueConstraint("user_id", "date", "model_version", "context_key", name="uq_daily_predictions"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    date = Column(Date, nullable=False)
+    model_version = Column(String, nullable=False)
+    context_key = Column(String(40), nullable=False)
+    predictions = Column(Text, nullable=False)  # JSON list, as returned by /api/predict_today
+    created_at = Column(DateTime, nullable=False)
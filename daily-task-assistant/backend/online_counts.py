@@ -0,0 +1,178 @@
+import datetime as dt
+import os
+from collections import Counter
+from typing import Dict, List
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+import models
+
+"""
+Online count-based predictor.
+
+For every (user, item, context bucket) we keep how often the item was
+labelled, needed, and needed-but-not-packed (item_outcome_counts), plus
+the same counts pooled over all users by item name
+(global_outcome_counts). The counts are derived from training_features
+and adjusted by the delta of each status write (see
+feature_store.refresh_features), so predictions from them are always
+current and never need a retrain.
+
+Estimates are Bayesian-smoothed and back off from the user's counts
+for today's bucket, to the pooled counts for that bucket, to the pooled
+counts for the item on any day, to a priority-based prior.
+"""
+
+# Pseudo-observations given to the next, coarser level at each back-off step
+COUNT_PRIOR_STRENGTH = float(os.environ.get("COUNT_PRIOR_STRENGTH", "5"))
+
+PRIOR_NEED = {"low": 0.3, "medium": 0.5, "high": 0.7}
+PRIOR_FORGET = 0.4
+
+
+def context_bucket(weekday, is_holiday, has_work_event, has_gym_event) -> int:
+    """Exact day-type code: 7 weekdays x 3 flags = 56 buckets."""
+    return int(weekday) * 8 + int(bool(is_holiday)) * 4 + int(bool(has_work_event)) * 2 + int(bool(has_gym_event))
+
+
+def _item_key(name: str) -> str:
+    return (name or "").strip().lower()
+
+
+def snapshot_counts(db: Session, *feature_criteria):
+    """
+    Count contributions of the training_features rows matching
+    `feature_criteria`, as (per-user Counter, pooled Counter). Counter
+    keys are the table key plus the column name ("n", "n_needed" or
+    "n_forgot").
+    """
+    tf = models.TrainingFeature
+    rows = db.execute(
+        select(tf.user_id, tf.item_id, models.Item.name,
+               tf.weekday, tf.is_holiday, tf.has_work_event, tf.has_gym_event,
+               tf.needed_label, tf.packed)
+        .join(models.Item, models.Item.id == tf.item_id)
+        .where(*feature_criteria)
+    ).all()
+
+    per_user, pooled = Counter(), Counter()
+    for user_id, item_id, name, weekday, holiday, work, gym, needed, packed in rows:
+        bucket = context_bucket(weekday, holiday, work, gym)
+        forgot = int(needed == 1 and packed == 0)
+        for counter, key in ((per_user, (user_id, item_id, bucket)), (pooled, (_item_key(name), bucket))):
+            counter[key + ("n",)] += 1
+            counter[key + ("n_needed",)] += int(needed)
+            counter[key + ("n_forgot",)] += forgot
+    return per_user, pooled
+
+
+def _deltas(before: Counter, after: Counter) -> Dict:
+    """{key: {column: delta}} for keys whose counts changed."""
+    out = {}
+    for full_key in set(before) | set(after):
+        change = after[full_key] - before[full_key]
+        if change:
+            *key, column = full_key
+            out.setdefault(tuple(key), {"n": 0, "n_needed": 0, "n_forgot": 0})[column] = change
+    return out
+
+
+def _upsert_counts(db: Session, table, key_columns, deltas: Dict, **values):
+    """Add `deltas` to the counts; `values` are also written to every changed row."""
+    if not deltas:
+        return
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={
+            **{c: getattr(table.c, c) + getattr(stmt.excluded, c) for c in ("n", "n_needed", "n_forgot")},
+            **{c: getattr(stmt.excluded, c) for c in values},
+        },
+    )
+    db.execute(stmt, [dict(zip(key_columns, key), **change, **values) for key, change in deltas.items()])
+
+
+def apply_count_changes(db: Session, before, after):
+    """
+    Add the difference between two snapshots (taken around a status
+    write) to the count tables: one upsert per changed key. Does not commit.
+    """
+    _upsert_counts(db, models.ItemOutcomeCount.__table__, ["user_id", "item_id", "context_bucket"],
+                   _deltas(before[0], after[0]))
+    _upsert_counts(db, models.GlobalOutcomeCount.__table__, ["item_name", "context_bucket"],
+                   _deltas(before[1], after[1]), updated_at=dt.datetime.utcnow())
+
+
+def rebuild_online_counts(db: Session):
+    """Recompute both count tables from training_features. Does not commit."""
+    db.execute(delete(models.ItemOutcomeCount))
+    db.execute(delete(models.GlobalOutcomeCount))
+    empty = (Counter(), Counter())
+    apply_count_changes(db, empty, snapshot_counts(db))
+
+
+def global_counts_version(db: Session) -> str:
+    """
+    Changes whenever the pooled counts do, i.e. on any user's status
+    write. Count-based predictions depend on it as well as on the user's
+    own data_version.
+    """
+    latest = db.query(func.max(models.GlobalOutcomeCount.updated_at)).scalar()
+    return latest.isoformat() if latest else ""
+
+
+def ensure_online_counts(db: Session):
+    """Backfill the count tables once for databases created before they existed."""
+    has_counts = db.query(models.GlobalOutcomeCount.id).first() is not None
+    has_features = db.query(models.TrainingFeature.status_id).first() is not None
+    if has_features and not has_counts:
+        rebuild_online_counts(db)
+        db.commit()
+
+
+def _smooth(positive, total, prior):
+    return (positive + COUNT_PRIOR_STRENGTH * prior) / (total + COUNT_PRIOR_STRENGTH)
+
+
+def predict_from_counts(db: Session, user_id: int, context_features: Dict, items: List[Dict]):
+    """
+    (need_probs, forget_probs) for `items` in today's context, from the
+    count tables (two indexed queries, no model files).
+    """
+    bucket = context_bucket(context_features["weekday"], context_features["is_holiday"],
+                            context_features["has_work_event"], context_features["has_gym_event"])
+    own = models.ItemOutcomeCount
+    user_counts = {
+        row.item_id: row
+        for row in db.query(own).filter(
+            own.user_id == user_id,
+            own.context_bucket == bucket,
+            own.item_id.in_([it["id"] for it in items]),
+        )
+    }
+
+    pooled = models.GlobalOutcomeCount
+    names = {_item_key(it["name"]) for it in items}
+    pooled_bucket, pooled_any = {}, Counter()
+    for row in db.query(pooled).filter(pooled.item_name.in_(names)):
+        if row.context_bucket == bucket:
+            pooled_bucket[row.item_name] = row
+        pooled_any[(row.item_name, "n")] += row.n
+        pooled_any[(row.item_name, "n_needed")] += row.n_needed
+        pooled_any[(row.item_name, "n_forgot")] += row.n_forgot
+
+    need_probs, forget_probs = [], []
+    for it in items:
+        name = _item_key(it["name"])
+        p_need = _smooth(pooled_any[(name, "n_needed")], pooled_any[(name, "n")],
+                         PRIOR_NEED.get(it["priority"], 0.5))
+        p_forget = _smooth(pooled_any[(name, "n_forgot")], pooled_any[(name, "n")], PRIOR_FORGET)
+        for row in (pooled_bucket.get(name), user_counts.get(it["id"])):
+            if row is not None:
+                p_need = _smooth(row.n_needed, row.n, p_need)
+                p_forget = _smooth(row.n_forgot, row.n, p_forget)
+        need_probs.append(p_need)
+        forget_probs.append(p_forget)
+    return need_probs, forget_probs
@@ -0,0 +1,90 @@
+import datetime as dt
+import os
+from typing import List
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+import models
+
+"""
+Debounced, coalesced personal retraining.
+
+Status writes only stamp the user's last_change_at (one upsert). A
+periodic job then picks users whose labels have been quiet for
+RETRAIN_DEBOUNCE_SECONDS and who gained at least RETRAIN_MIN_NEW_LABELS
+labelled rows since their last fit, so a burst of checklist saves ends
+in a single fit. Users flagged by request_refits() are picked up on the
+next run without either condition.
+"""
+
+RETRAIN_MIN_NEW_LABELS = int(os.environ.get("RETRAIN_MIN_NEW_LABELS", "20"))
+RETRAIN_DEBOUNCE_SECONDS = int(os.environ.get("RETRAIN_DEBOUNCE_SECONDS", "300"))
+RETRAIN_BATCH_SIZE = int(os.environ.get("RETRAIN_BATCH_SIZE", "10"))
+
+
+def mark_labels_changed(db: Session, user_id: int):
+    """Record that the user's labels changed. Does not commit."""
+    now = dt.datetime.utcnow()
+    stmt = insert(models.ModelTrainingState).values(user_id=user_id, labels_at_fit=0, last_change_at=now)
+    db.execute(stmt.on_conflict_do_update(index_elements=["user_id"], set_={"last_change_at": now}))
+
+
+def request_refits(db: Session, user_ids: List[int]):
+    """Queue these users for a refit on the next run. Does not commit."""
+    if not user_ids:
+        return
+    stmt = insert(models.ModelTrainingState).values(
+        [{"user_id": user_id, "labels_at_fit": 0, "refit_requested": True} for user_id in user_ids]
+    )
+    db.execute(stmt.on_conflict_do_update(index_elements=["user_id"], set_={"refit_requested": True}))
+
+
+def labelled_row_count(db: Session, user_id: int) -> int:
+    return db.execute(
+        select(func.count()).select_from(models.TrainingFeature)
+        .where(models.TrainingFeature.user_id == user_id)
+    ).scalar()
+
+
+def due_retrains(db: Session, limit: int = RETRAIN_BATCH_SIZE) -> List[int]:
+    """
+    Users whose model is out of date: changed since the last fit, quiet
+    for the debounce period, and past the new-label threshold, or
+    flagged by request_refits(). Flagged users first, then
+    longest-waiting first.
+    """
+    state = models.ModelTrainingState
+    quiet_since = dt.datetime.utcnow() - dt.timedelta(seconds=RETRAIN_DEBOUNCE_SECONDS)
+    labelled = func.count(models.TrainingFeature.status_id)
+    requested = state.refit_requested.is_(True)
+    return db.execute(
+        select(state.user_id)
+        .join(models.TrainingFeature, models.TrainingFeature.user_id == state.user_id)
+        .where(or_(
+            requested,
+            and_(state.last_change_at <= quiet_since,
+                 or_(state.last_trained_at.is_(None), state.last_change_at > state.last_trained_at)),
+        ))
+        .group_by(state.user_id, state.labels_at_fit, state.last_change_at, state.refit_requested)
+        .having(or_(requested, labelled - state.labels_at_fit >= RETRAIN_MIN_NEW_LABELS))
+        .order_by(requested.desc(), state.last_change_at)
+        .limit(limit)
+    ).scalars().all()
+
+
+def record_training(db: Session, user_id: int, labels_at_fit: int, started_at: dt.datetime):
+    """
+    Remember what the new model was fitted on. `started_at` (taken before
+    the training data was read) becomes last_trained_at, so changes made
+    during the fit still count as newer than the model. Commits.
+    """
+    stmt = insert(models.ModelTrainingState).values(
+        user_id=user_id, labels_at_fit=labels_at_fit, last_trained_at=started_at, refit_requested=False
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"labels_at_fit": labels_at_fit, "last_trained_at": started_at, "refit_requested": False},
+    ))
+    db.commit()
@@ -6,6 +6,7 @@ from werkzeug.security import generate_password_hash
 
 from database import SessionLocal, Base, engine
 import models
+from feature_store import rebuild_feature_store
 from ml import train_models_for_user
 
 """
@@ -225,6 +226,9 @@ def seed_from_csv():
         db.commit()
         print("Finished importing all rows from CSV.")
 
+        rebuild_feature_store(db)
+        print("Rebuilt training feature table.")
+
         # Train model for each user
         print("\nTraining models for users...")
         for email, user in users_seen.items():
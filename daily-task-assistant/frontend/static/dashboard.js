@@ -19,55 +19,69 @@ const ctxSummary = document.getElementById("context-summary");
 let predictions = [];
 let packedState = {};
 
-async function loadContextSummary() {
-  try {
-    const data = await fetchJSON("/api/insights");
-    const ctx = data.today_context;
-    const metrics = data.model_metrics || {};
-    let parts = [];
-
-    if (ctx) {
-      const weekdayNames = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"];
-      const weekdayName = weekdayNames[ctx.weekday] || ctx.weekday;
-      parts.push(`${ctx.day_type} (${weekdayName})`);
-      if (ctx.has_work_event) parts.push("work day");
-      if (ctx.has_gym_event) parts.push("gym day");
-    }
-
-    let txt = "";
-    if (parts.length) {
-      txt = "Today looks like: " + parts.join(" · ");
-    } else {
-      txt = "Today’s context is not labelled yet.";
-    }
-
-    if (metrics && metrics.n_samples) {
-      txt += ` | Model trained on ${metrics.n_samples} samples (F1: ${(metrics.f1 * 100).toFixed(
-        1
-      )}%)`;
-    } else {
-      txt += " | Model not fully trained yet.";
-    }
-
-    ctxSummary.textContent = txt;
-  } catch (e) {
-    console.error(e);
-    ctxSummary.textContent = "Could not load context summary.";
+// Checklist toggles are queued per item and sent as one delta batch
+// shortly after the last change, tagged with the checklist version they
+// were made against (see /api/checklist_update).
+const SYNC_DEBOUNCE_MS = 800;
+let checklistVersion = 0;
+let pendingChanges = {};
+let syncTimer = null;
+let syncInFlight = null;
+
+function renderContextSummary(ctx, metrics) {
+  metrics = metrics || {};
+  let parts = [];
+
+  if (ctx) {
+    const weekdayNames = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"];
+    const weekdayName = weekdayNames[ctx.weekday] || ctx.weekday;
+    parts.push(`${ctx.day_type} (${weekdayName})`);
+    if (ctx.has_work_event) parts.push("work day");
+    if (ctx.has_gym_event) parts.push("gym day");
+  }
+
+  let txt = "";
+  if (parts.length) {
+    txt = "Today looks like: " + parts.join(" · ");
+  } else {
+    txt = "Today’s context is not labelled yet.";
   }
+
+  if (metrics && metrics.n_samples) {
+    const scoredOn = metrics.evaluation === "holdout" ? "held-out F1" : "training F1";
+    txt += ` | Model trained on ${metrics.n_samples} samples (${scoredOn}: ${(metrics.f1 * 100).toFixed(
+      1
+    )}%)`;
+  } else {
+    txt += " | Model not fully trained yet.";
+  }
+
+  ctxSummary.textContent = txt;
 }
 
-async function loadPredictions() {
+// One request for everything the dashboard shows (context, metrics,
+// predictions and today's saved checklist state).
+async function loadDashboard() {
   checklistContainer.innerHTML = "<div class='loading'>Loading predictions...</div>";
   try {
-    const data = await fetchJSON("/api/predict_today");
-    const preds = data.predictions || [];
-    predictions = preds;
+    const data = await fetchJSON(
+      "/api/dashboard?fields=predictions,checklist,today_context,model_metrics"
+    );
+    renderContextSummary(data.today_context, data.model_metrics);
+
+    predictions = data.predictions || [];
+    checklistVersion = (data.checklist && data.checklist.version) || 0;
+    const saved = {};
+    ((data.checklist && data.checklist.items) || []).forEach((it) => {
+      saved[it.item_id] = it.packed;
+    });
     packedState = {};
     predictions.forEach((p) => {
-      packedState[p.item_id] = false;
+      packedState[p.item_id] = !!saved[p.item_id];
     });
     renderChecklist();
   } catch (e) {
+    ctxSummary.textContent = "Could not load context summary.";
     checklistContainer.innerHTML = "<div class='loading'>Failed to load predictions.</div>";
     console.error(e);
   }
@@ -102,6 +116,7 @@ function renderChecklist() {
     input.checked = !!packedState[p.item_id];
     input.addEventListener("change", () => {
       packedState[p.item_id] = input.checked;
+      queueChange(p.item_id, { packed: input.checked });
     });
     right.appendChild(input);
     right.append(" Packed");
@@ -115,34 +130,87 @@ function renderChecklist() {
   checklistContainer.appendChild(wrapper);
 }
 
-async function syncChecklist(neededLabel = true) {
-  const statuses = predictions.map((p) => ({
-    item_id: p.item_id,
-    packed: !!packedState[p.item_id],
-    needed_label: neededLabel, // assume predicted items are needed
-  }));
-  try {
-    await fetchJSON("/api/checklist_update", {
-      method: "POST",
-      body: JSON.stringify({ statuses }),
+function queueChange(itemId, change) {
+  // later toggles of the same item replace earlier ones
+  pendingChanges[itemId] = { ...pendingChanges[itemId], ...change, item_id: itemId };
+  clearTimeout(syncTimer);
+  syncTimer = setTimeout(flushChanges, SYNC_DEBOUNCE_MS);
+}
+
+function requeue(changes) {
+  // changes made while a batch was in flight win over the failed batch
+  changes.forEach((c) => {
+    pendingChanges[c.item_id] = { ...c, ...pendingChanges[c.item_id] };
+  });
+}
+
+async function postChanges(changes, keepalive = false) {
+  const res = await fetch("/api/checklist_update", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    credentials: "same-origin",
+    keepalive,
+    body: JSON.stringify({ version: checklistVersion, changes }),
+  });
+  const data = await res.json().catch(() => ({}));
+  return { status: res.status, data };
+}
+
+async function sendChanges(changes) {
+  let { status, data } = await postChanges(changes);
+  if (status === 409) {
+    // written elsewhere since we loaded: take the server's state for
+    // untouched items, then re-apply our changes on top of its version
+    checklistVersion = data.version;
+    (data.checklist.items || []).forEach((it) => {
+      const ours = changes.some((c) => c.item_id === it.item_id) || it.item_id in pendingChanges;
+      if (!ours && it.item_id in packedState) packedState[it.item_id] = it.packed;
     });
-  } catch (e) {
-    console.error("Failed to update checklist", e);
+    renderChecklist();
+    ({ status, data } = await postChanges(changes));
+  }
+  if (status !== 200) {
+    throw new Error(`Checklist sync failed (${status})`);
   }
+  checklistVersion = data.version;
+}
+
+async function flushChanges() {
+  clearTimeout(syncTimer);
+  while (syncInFlight) {
+    await syncInFlight; // one batch at a time, so versions stay in order
+  }
+  const changes = Object.values(pendingChanges);
+  if (!changes.length) return;
+  pendingChanges = {};
+
+  syncInFlight = sendChanges(changes)
+    .catch((e) => {
+      requeue(changes);
+      console.error("Failed to update checklist", e);
+    })
+    .finally(() => {
+      syncInFlight = null;
+    });
+  await syncInFlight;
 }
 
 btnTrain.addEventListener("click", async () => {
   try {
     await fetchJSON("/api/train_model", { method: "POST" });
     alert("Model trained successfully!");
-    await loadContextSummary();
+    if (!window.EventSource) await loadDashboard(); // otherwise pushed via /api/events
   } catch (e) {
     alert("Could not train model yet. Need more diverse data.");
   }
 });
 
 btnLeaving.addEventListener("click", async () => {
-  await syncChecklist(true);
+  // leaving confirms every predicted item as needed; unchanged rows are skipped server-side
+  predictions.forEach((p) => {
+    queueChange(p.item_id, { packed: !!packedState[p.item_id], needed_label: true });
+  });
+  await flushChanges();
 
   const missingImportant = predictions.filter(
     (p) => !packedState[p.item_id] && p.need_probability > 0.6
@@ -158,5 +226,39 @@ btnLeaving.addEventListener("click", async () => {
   }
 });
 
-loadContextSummary();
-loadPredictions();
\ No newline at end of file
+async function refreshSummary() {
+  try {
+    const data = await fetchJSON("/api/dashboard?fields=today_context,model_metrics");
+    renderContextSummary(data.today_context, data.model_metrics);
+  } catch (e) {
+    console.error(e);
+  }
+}
+
+// Pushed by the server when a retrain finishes or today's predictions
+// change, so the dashboard never has to poll.
+function subscribeEvents() {
+  if (!window.EventSource) return;
+  const source = new EventSource("/api/events");
+  source.addEventListener("model-updated", refreshSummary);
+  source.addEventListener("predictions", (e) => {
+    const data = JSON.parse(e.data);
+    predictions = data.predictions || [];
+    predictions.forEach((p) => {
+      packedState[p.item_id] = !!packedState[p.item_id];
+    });
+    renderChecklist();
+  });
+}
+
+// don't lose toggles still waiting for the debounce when the page closes
+window.addEventListener("pagehide", () => {
+  const changes = Object.values(pendingChanges);
+  if (changes.length && !syncInFlight) {
+    pendingChanges = {};
+    postChanges(changes, true).catch(() => {});
+  }
+});
+
+loadDashboard();
+subscribeEvents();
\ No newline at end of file
@@ -41,13 +41,17 @@ function renderInsights(data) {
     mDiv.className = "list-item";
     mDiv.innerHTML = `
       <div>
-        <strong>Model performance (on training data)</strong>
+        <strong>Model performance (${
+          model_metrics.evaluation === "holdout" ? "on held-out recent days" : "on training data"
+        })</strong>
         <div class="small-text">
           Accuracy: ${(model_metrics.accuracy * 100).toFixed(1)}% ·
           Precision: ${(model_metrics.precision * 100).toFixed(1)}% ·
           Recall: ${(model_metrics.recall * 100).toFixed(1)}% ·
           F1: ${(model_metrics.f1 * 100).toFixed(1)}%<br />
-          Samples used: ${model_metrics.n_samples}
+          Samples used: ${model_metrics.n_samples}${
+            model_metrics.n_eval ? ` · Evaluated on: ${model_metrics.n_eval}` : ""
+          }
         </div>
       </div>
     `;
@@ -136,4 +140,54 @@ async function loadInsights() {
   }
 }
 
-loadInsights();
\ No newline at end of file
+// ---------- Past days (paginated /api/history) ----------
+
+const pastDaysContainer = document.getElementById("past-days-container");
+const btnLoadMore = document.getElementById("btn-load-more");
+let historyCursor = null;
+
+function renderPastDay(day) {
+  const li = document.createElement("li");
+  li.className = "list-group-item";
+
+  const packed = day.items.filter((it) => it.packed).length;
+  const forgotten = day.items.filter((it) => it.needed_label && !it.packed);
+  const weekdayNames = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"];
+
+  li.innerHTML = `
+    <div class="d-flex justify-content-between">
+      <span class="fw-semibold">${day.date} (${weekdayNames[day.weekday] || day.weekday})</span>
+      <span class="small text-muted">${packed}/${day.items.length} packed</span>
+    </div>
+    <div class="small-text">
+      ${day.has_work_event ? "Work event · " : ""}${day.has_gym_event ? "Gym event · " : ""}
+      ${forgotten.length ? "Forgot: " + forgotten.map((it) => it.name).join(", ") : "Nothing forgotten"}
+    </div>
+  `;
+  pastDaysContainer.appendChild(li);
+}
+
+async function loadPastDays() {
+  btnLoadMore.disabled = true;
+  try {
+    const url = historyCursor
+      ? `/api/history?cursor=${encodeURIComponent(historyCursor)}`
+      : "/api/history";
+    const data = await fetchJSON(url);
+    data.days.forEach(renderPastDay);
+    if (!historyCursor && !data.days.length) {
+      pastDaysContainer.innerHTML = "<li class='list-group-item text-muted'>No history yet.</li>";
+    }
+    historyCursor = data.next_cursor;
+    btnLoadMore.style.display = historyCursor ? "" : "none";
+  } catch (e) {
+    console.error(e);
+  } finally {
+    btnLoadMore.disabled = false;
+  }
+}
+
+btnLoadMore.addEventListener("click", loadPastDays);
+
+loadInsights();
+loadPastDays();
\ No newline at end of file